@@ -1,26 +1,163 @@
 from __future__ import annotations
 
+import asyncio
+import time
+from os import environ
+from typing import Any, Dict
+
 from discord import ChannelType, Game, Status  # type: ignore
 from discord.ext import commands  # type: ignore
 from discord.flags import Intents  # type: ignore
 
 from .cogs import admin, error_handler, verify
+from .cogs.util import (broker, db, diagnostics, guild_cache, metrics,
+                        probe, ratelimit, rest, ses, sessions)
 from .cogs.util.config import CONFIG
 from .logger import get_logger
 
 logger = get_logger(__name__)
 
-bot = commands.Bot(CONFIG["DEFAULT"]["command_prefix"], intents=Intents.all())
+
+class VerifyBot(commands.AutoShardedBot):
+    async def on_ready(self):
+        logger.info(f"We have logged in as {self.user}")
+        game = Game("SMTP")
+        await self.change_presence(status=Status.online, activity=game)
+
+    async def close(self):
+        # Write out any buffered verification sessions before disconnecting
+        await sessions.store.stop()
+        await broker.bus.stop()
+        await probe.close()
+        await ses.dispatcher.stop(
+            CONFIG["DEFAULT"].getfloat("ses_drain_seconds", fallback=10))
+        await super().close()
+
+
+async def prepare_db():
+    """Connect, migrate and restore sessions. Safe to run again on failure."""
+    await db.connect()
+    await db.ensure_schema()
+    await sessions.store.rehydrate()
+
+
+async def warm_up(bot: VerifyBot):
+    """Connect to services and fill caches while the gateway connects
+
+    SES is warmed up alongside the db. The db is retried, and if it still
+    can't be prepared the bot shuts down rather than running without it.
+    The guild settings cache and SES fill on demand, so their failures are
+    only logged.
+    """
+    start = time.monotonic()
+    ses_warm_up = asyncio.ensure_future(ses.warm_up())
+
+    config = CONFIG["DEFAULT"]
+    retries = config.getint("warm_up_retries", fallback=5)
+    retry_seconds = config.getfloat("warm_up_retry_seconds", fallback=5)
+    for attempt in range(1, retries + 1):
+        try:
+            await prepare_db()
+            break
+        except Exception as e:
+            logger.error(f"Preparing the db failed ({attempt}/{retries}): {e}")
+            if attempt == retries:
+                logger.critical("Could not prepare the db, shutting down")
+                ses_warm_up.cancel()
+                await bot.close()
+                return
+
+            await asyncio.sleep(retry_seconds * attempt)
+
+    sessions.store.start()
+    broker.bus.start()
+
+    results = await asyncio.gather(guild_cache.load_all(),
+                                   ses_warm_up,
+                                   return_exceptions=True)
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error(f"Warm up failed: {result}")
+
+    logger.info(f"Warmed up in {time.monotonic() - start:.2f}s")
+
+
+def start_metrics():
+    if not metrics.start():
+        return
+
+    metrics.track_queue("ses", ses.dispatcher.queue_depth)
+    metrics.track_queue("session_writes", sessions.store.pending_writes)
+    metrics.track_queue("role_edits", rest.scheduler.pending_role_edits)
+
+
+def shard_options() -> Dict[str, Any]:
+    """Shards for this process, from SHARD_IDS (e.g. "0,1") and SHARD_COUNT
+
+    Without them discord.py picks the shard count and runs every shard in
+    this process.
+    """
+    shard_ids = environ.get("SHARD_IDS")
+    if not shard_ids:
+        return {}
+
+    return {
+        "shard_ids": [int(shard_id) for shard_id in shard_ids.split(",")],
+        "shard_count": int(environ["SHARD_COUNT"])
+    }
+
+
+def share_state():
+    """Keep sessions and rate limits consistent with other shard processes"""
+    sessions.store.shared = True
+
+    stores = ratelimit.limiter.stores
+    memory_rules = [
+        name for name, store in stores.items()
+        if not isinstance(store, ratelimit.MongoStore)
+    ]
+    if memory_rules:
+        logger.warning(f"Memory rate limits for {', '.join(memory_rules)} "
+                       "would be per process, using the mongo store instead")
+        mongo_store = ratelimit.MongoStore()
+        for name in memory_rules:
+            stores[name] = mongo_store
+
+    if not isinstance(broker.bus, broker.MongoBroker):
+        logger.warning("Set broker to capped or changestream so cache "
+                       "invalidations reach the other shard processes")
+
+
+def create_bot() -> VerifyBot:
+    options = shard_options()
+    if options:
+        share_state()
+
+    broker.bus.subscribe("guild", guild_cache.invalidate)
+    broker.bus.subscribe("session", sessions.store.forget)
+
+    bot = VerifyBot(CONFIG["DEFAULT"]["command_prefix"],
+                    intents=Intents.all(),
+                    **options)
+
+    bot.loop.call_soon(start_metrics)
+    bot.loop.call_soon(diagnostics.start_watchdog)
+    bot.loop.create_task(warm_up(bot))
+
+    profiler = diagnostics.get_profiler()
+    for cog in (admin.Admin(bot), verify.Verify(bot),
+                error_handler.CommandErrorHandler()):
+        if profiler is not None:
+            profiler.instrument_cog(cog)
+        bot.add_cog(cog)
+
+    return bot
 
 
-@bot.event
-async def on_ready():
-    logger.info(f"We have logged in as {bot.user}")
-    game = Game("SMTP")
-    await bot.change_presence(status=Status.online, activity=game)
+def main():
+    bot = create_bot()
+    bot.run(CONFIG["DEFAULT"]["discord_token"])
 
 
-bot.add_cog(admin.Admin())
-bot.add_cog(verify.Verify(bot))
-bot.add_cog(error_handler.CommandErrorHandler())
-bot.run(CONFIG["DEFAULT"]["discord_token"])
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,345 @@
 from __future__ import annotations
 
-import pprint
-from typing import Dict, List, NamedTuple, Union
+import asyncio
+import csv
+import gzip
+import io
+import json
+import math
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Tuple
 
-from discord import Embed, Guild, Member  # type: ignore
+from discord import ChannelType, Embed, File, Guild, Member  # type: ignore
 from discord.ext import commands, menus  # type: ignore
 
 from ..logger import get_logger
-from .util import db
+from .datatypes.email_address import Email
+from .datatypes.user import User
+from .util import db, diagnostics, export, guild_cache, rest, util
+from .util.config import CONFIG
 
 logger = get_logger(__name__)
 
 
 class Admin(commands.Cog):
     """Admin only commands"""
+    bot: commands.Bot
 
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
 
-class MembersSource(menus.ListPageSource):
-    def __init__(self, entries: List[Dict[str, Union[Member, str]]],
-                 guild: Guild):
+    @commands.command(name="verifiedmembers")
+    @util.is_admin()
+    async def verified_members(self, ctx: commands.Context, *, search=""):
+        """
+        Lists verified members, optionally those whose email or username
+        starts with the search
+        """
+        if ctx.channel.type == ChannelType.private:
+            return
+
+        guild: Guild = ctx.guild
+        email_prefix = search
+        user_ids = None
+        if search and "@" not in search:
+            # Usernames aren't stored, so match them against the member
+            # cache and look the ids up on the user_id index
+            name = search.lower()
+            user_ids = [
+                str(m.id) for m in guild.members
+                if m.name.lower().startswith(name)
+                or m.display_name.lower().startswith(name)
+            ]
+
+        query = db.verified_members_filter(str(guild.id),
+                                           email_prefix=email_prefix,
+                                           user_ids=user_ids)
+        source = MembersSource(
+            guild,
+            query,
+            per_page=CONFIG["DEFAULT"].getint("members_per_page",
+                                              fallback=10))
+        pages = menus.MenuPages(source=source, clear_reactions_after=True)
+        await pages.start(ctx)
+
+    @commands.command(name="export")
+    @util.is_admin()
+    async def export_records(self,
+                             ctx: commands.Context,
+                             fmt: str = "ndjson",
+                             since: str = ""):
+        """
+        Exports verified users, emails and attempts as gzipped NDJSON or CSV,
+        optionally only those since an ISO 8601 time
+        """
+        if ctx.channel.type == ChannelType.private:
+            return
+
+        if fmt not in export.FORMATS:
+            await ctx.send(
+                f"Format must be one of {', '.join(export.FORMATS)}")
+            return
+
+        try:
+            since_time = export.parse_since(since) if since else None
+        except ValueError:
+            await ctx.send("since must be an ISO 8601 date or time, "
+                           "e.g. 2021-02-01 or 2021-02-01T09:00:00+10:00")
+            return
+
+        guild: Guild = ctx.guild
+        # Records are streamed to disk, never held in memory together
+        with tempfile.TemporaryFile() as tmp:
+            with gzip.open(tmp, "wt", encoding="utf-8", newline="") as out:
+                count = await export.write_export(out,
+                                                  str(guild.id),
+                                                  fmt=fmt,
+                                                  since=since_time)
+
+            size = tmp.tell()
+            if size > guild.filesize_limit:
+                await ctx.send(
+                    f"The export is too large to upload ({size} bytes). "
+                    f"Run `python -m src.export {guild.id}` on the server "
+                    "instead.")
+                return
+
+            tmp.seek(0)
+            await ctx.send(f"Exported {count} records.",
+                           file=File(tmp,
+                                     filename=f"{guild.id}.{fmt}.gz"))
+
+        logger.info(f"Exported {count} records for guild {guild.id}")
+
+    @commands.command(name="profile")
+    @util.is_admin()
+    async def profile(self, ctx: commands.Context, action: str = ""):
+        """
+        Uploads recent event loop stalls and sampled profiles, or clears the
+        profiles with reset
+        """
+        if action == "reset":
+            if diagnostics.profiler is not None:
+                diagnostics.profiler.reset()
+            await ctx.send("Profiles cleared.")
+            return
+
+        report = diagnostics.report(
+            CONFIG["DEFAULT"].getint("profile_report_lines", fallback=25))
+        await ctx.send(file=File(io.BytesIO(report.encode("utf-8")),
+                                 filename="profile.txt"))
+
+    @commands.command(name="bulkverify")
+    @util.is_admin()
+    async def bulk_verify(self, ctx: commands.Context):
+        """
+        Verifies members from an attached CSV or JSON roster
+        """
+        if ctx.channel.type == ChannelType.private:
+            return
+
+        if not ctx.message.attachments:
+            await ctx.send(
+                "Please attach a CSV or JSON roster with discord_id and "
+                "email for each member.")
+            return
+
+        attachment = ctx.message.attachments[0]
+        try:
+            roster = parse_roster(attachment.filename, await attachment.read())
+        except (ValueError, KeyError, TypeError) as e:
+            await ctx.send(f"Unable to read the roster: {e}")
+            return
+
+        guild: Guild = ctx.guild
+        settings = await guild_cache.get_settings(str(guild.id))
+        verified_role = guild.get_role(int(settings.verified_role_id or 0))
+        if verified_role is None:
+            await ctx.send("This server does not have a verified role.")
+            return
+
+        start = time.monotonic()
+        progress = await ctx.send(
+            f"Validating {len(roster)} roster entries...")
+
+        # Validate in parallel with the same rules and probes as !verify
+        config = CONFIG["DEFAULT"]
+        validated = await validate_roster(
+            guild, roster, config.getint("bulk_validate_workers", fallback=10))
+        valid = [(member, email) for member, email, _ in validated if email]
+        rejected = len(validated) - len(valid)
+
+        # Don't take over emails another member has already verified with
+        owners = await db.get_email_owners([e.address for _, e in valid],
+                                           str(guild.id))
+        valid = [(member, email) for member, email in valid
+                 if owners.get(email.address, str(member.id)) == str(
+                     member.id)]
+        conflicts = len(validated) - rejected - len(valid)
+
+        await progress.edit(content=f"Validated {len(roster)} entries in "
+                            f"{time.monotonic() - start:.1f}s. Saving "
+                            f"{len(valid)} members...")
+
+        users = [
+            User(str(member.id), member.name, str(member.discriminator),
+                 "verified") for member, _ in valid
+        ]
+        await db.mark_users_verified(users, str(guild.id))
+        await db.add_verified_emails([(str(member.id), email.address)
+                                      for member, email in valid],
+                                     str(guild.id))
+
+        # Grant the role in batches, paced by the REST scheduler
+        to_grant = [m for m, _ in valid if verified_role not in m.roles]
+        batch_size = config.getint("bulk_role_batch_size", fallback=25)
+        granted = failed = 0
+        for i in range(0, len(to_grant), batch_size):
+            batch = to_grant[i:i + batch_size]
+            results = await asyncio.gather(*[
+                rest.scheduler.add_roles(
+                    member, verified_role, reason="MACS Verify bulk import")
+                for member in batch
+            ],
+                                           return_exceptions=True)
+            for member, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    failed += 1
+                    logger.warning(
+                        f"Failed to add verified role to {member.id}: "
+                        f"{result}")
+                else:
+                    granted += 1
+
+            elapsed = time.monotonic() - start
+            await progress.edit(
+                content=f"Granted the verified role to {granted}/"
+                f"{len(to_grant)} members ({granted / elapsed:.1f}/s)...")
+
+        elapsed = time.monotonic() - start
+        await progress.edit(
+            content=f"Bulk verification finished in {elapsed:.1f}s "
+            f"({len(roster) / elapsed:.1f} entries/s).\n"
+            f"Verified: {len(valid)}\n"
+            f"Role granted: {granted}, failed: {failed}\n"
+            f"Rejected: {rejected}\n"
+            f"Email already used by another member: {conflicts}")
+        logger.info(f"Bulk verified {len(valid)} members in guild {guild.id}")
+
+
+def parse_roster(filename: str, data: bytes) -> List[Tuple[str, str]]:
+    """Parse a roster file into (discord id, email) pairs
+
+    JSON rosters are a list of {"discord_id": ..., "email": ...} objects, CSV
+    rosters need a discord_id,email header row.
+    """
+    text = data.decode("utf-8-sig")
+
+    if filename.lower().endswith(".json"):
+        rows = json.loads(text)
+    else:
+        rows = list(csv.DictReader(io.StringIO(text)))
+
+    roster = []
+    seen = set()
+    for row in rows:
+        discord_id = str(row["discord_id"]).strip()
+        email = str(row["email"]).strip()
+        # The first entry for an email wins
+        if email.lower() not in seen:
+            seen.add(email.lower())
+            roster.append((discord_id, email))
+
+    return roster
+
+
+async def validate_roster(
+        guild: Guild, roster: List[Tuple[str, str]], workers: int
+) -> List[Tuple[Optional[Member], Optional[Email], str]]:
+    """Validate roster entries with a pool of concurrent workers
+
+    Student mailbox probes share the smtp_probe_sessions SMTP sessions with
+    !verify, so no more than that many run at once whatever workers is.
+
+    Returns:
+        List[Tuple[Optional[Member], Optional[Email], str]]: (member, email,
+        error) per entry. email is None if the entry was rejected.
+    """
+    semaphore = asyncio.Semaphore(workers)
+
+    async def validate(discord_id: str, address: str):
+        try:
+            member = guild.get_member(int(discord_id))
+        except ValueError:
+            return None, None, f"Invalid discord id {discord_id}"
+        if member is None:
+            return None, None, f"{discord_id} is not a member"
+
+        async with semaphore:
+            try:
+                email = await Email.from_user_input(address)
+            except Exception as e:
+                return member, None, str(e)
+
+        return member, email, ""
+
+    return await asyncio.gather(*[validate(*entry) for entry in roster])
+
+
+class MembersSource(menus.PageSource):
+    """Verified members of a guild, fetched from the db one page at a time
+
+    Only the current page is held in memory. Moving forward a page is a range
+    query continuing from the last email shown, other jumps skip.
+    """
+    def __init__(self, guild: Guild, query: Dict[str, Any], per_page: int):
         """MembersSource
 
         Args:
-            entries (List[Dict[str, Union[Member, str]]]): {"member": Member, "email": str}
             guild (Guild): Discord Guild
+            query (Dict[str, Any]): Filter from db.verified_members_filter
+            per_page (int): Members per page
         """
-        super().__init__(entries, per_page=10)
+        self.per_page = per_page
         self._guild = guild
+        self._query = query
+        self._count = 0
+        self._last_page = -1
+        self._last_email: Optional[str] = None
+
+    async def prepare(self):
+        self._count = await db.count_verified_members(self._query)
+
+    def is_paginating(self) -> bool:
+        return self._count > self.per_page
+
+    def get_max_pages(self) -> int:
+        return max(1, math.ceil(self._count / self.per_page))
+
+    async def get_page(self, page_number: int) -> List[Dict[str, str]]:
+        after_email = None
+        if page_number == self._last_page + 1:
+            after_email = self._last_email
+
+        entries = await db.get_verified_members_page(
+            self._query,
+            self.per_page,
+            after_email=after_email,
+            skip=page_number * self.per_page)
+
+        if entries:
+            self._last_page = page_number
+            self._last_email = entries[-1]["email"]
+
+        return entries
 
-    async def format_page(
-            self, menu, entries: List[Dict[str, Union[Member, str]]]) -> Embed:
+    async def format_page(self, menu, entries: List[Dict[str, str]]) -> Embed:
         """Format page for the embed
 
         Args:
-            menu ([type]): [description]
-            entries (List[Dict[str, Union[Member, str]]]): {"member": Member, "email": str}
+            menu (menus.MenuPages): The menu showing the page
+            entries (List[Dict[str, str]]): {"user_id": str, "email": str}
 
         Returns:
             Embed: The formatted embed
@@ -43,18 +348,19 @@ class MembersSource(menus.ListPageSource):
 
         fields = []
         for i, d in enumerate(entries, start=offset):
-            m: Member = d["member"]
-            e: str = d["email"]
-            fields.append({
-                'name': f'{i+1}. {m.name}#{m.discriminator}',
-                'value': e
-            })
+            m: Optional[Member] = self._guild.get_member(int(d["user_id"]))
+            name = (f"{m.name}#{m.discriminator}"
+                    if m else f"Left the server ({d['user_id']})")
+            fields.append({'name': f'{i+1}. {name}', 'value': d["email"]})
 
         embed = Embed.from_dict({
             'title': f'Verified Members for {self._guild.name}',
             'type': 'rich',
             'fields': fields,
-            'color': 0x89c6f6
+            'color': 0x89c6f6,
+            'footer': {
+                'text': f'{self._count} members'
+            }
         })
 
         return embed
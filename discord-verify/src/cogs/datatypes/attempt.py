@@ -1,18 +1,53 @@
 from __future__ import annotations
 
-import copy
-from datetime import datetime
-from typing import Dict
+from datetime import datetime, timezone
+from typing import Dict, Optional, Union
 
 from cerberus import Validator  # type: ignore
 
 from .email_address import Email
 
+ATTEMPT_SCHEMA = {
+    "verification_code": {
+        "type": "string",
+        "required": True,
+        "coerce": str,
+        "minlength": 16,
+        "maxlength": 16
+    },
+    "guild_id": {
+        "type": "string",
+        "required": True,
+        "coerce": str,
+        "maxlength": 50
+    }
+}
+ATTEMPT_VALIDATOR = Validator(ATTEMPT_SCHEMA)
+
+
+def parse_attempt_time(
+        attempt_time: Union[datetime, str, None]) -> datetime:
+    """Normalise a stored attempt time to an aware UTC datetime
+
+    Attempt times used to be stored as str(datetime.now()) in local time.
+    """
+    if not attempt_time:
+        return datetime.now(timezone.utc)
+    if isinstance(attempt_time, str):
+        attempt_time = datetime.fromisoformat(attempt_time)
+    if attempt_time.tzinfo is None:
+        return attempt_time.astimezone(timezone.utc)
+
+    return attempt_time
+
 
 class Attempt:
+    __slots__ = ("guild_id", "verification_code", "attempt_time", "status",
+                 "email")
+
     guild_id: str
     verification_code: str
-    attempt_time: str
+    attempt_time: datetime
     status: str
     email: Email
 
@@ -20,25 +55,40 @@ class Attempt:
                  verification_code: str,
                  guild_id: str,
                  email: Email,
-                 attempt_time: str = ""):
+                 attempt_time: Optional[datetime] = None):
         if Attempt.is_valid(verification_code, guild_id):
             self.guild_id = guild_id
             self.verification_code = verification_code
             self.email = email
+            self.status = ""
 
             if attempt_time:
                 self.attempt_time = attempt_time
             else:
-                self.attempt_time = str(datetime.now())
+                self.attempt_time = datetime.now(timezone.utc)
 
     @staticmethod
     def to_dict(attempt: Attempt) -> Dict:
-        attempt_copy = copy.deepcopy(attempt)
-
-        if attempt_copy.email:
-            attempt_copy.email = attempt_copy.email.address  # type: ignore
+        return {
+            "guild_id": attempt.guild_id,
+            "verification_code": attempt.verification_code,
+            "email": attempt.email.address if attempt.email else None,
+            "attempt_time": attempt.attempt_time,
+            "status": attempt.status
+        }
 
-        return vars(attempt_copy)
+    @staticmethod
+    def from_dict(attempt_dict: Dict) -> Attempt:
+        """Rebuild a stored attempt without validation"""
+        attempt = Attempt.__new__(Attempt)
+        attempt.verification_code = attempt_dict["verification_code"]
+        attempt.guild_id = attempt_dict["guild_id"]
+        attempt.email = Email.from_trusted(attempt_dict["email"])
+        attempt.attempt_time = parse_attempt_time(
+            attempt_dict.get("attempt_time"))
+        attempt.status = attempt_dict.get("status", "")
+
+        return attempt
 
     @staticmethod
     def is_valid(verification_code: str, guild_id: str) -> bool:
@@ -47,29 +97,10 @@ class Attempt:
             "guild_id": guild_id
         }
 
-        schema = {
-            "verification_code": {
-                "type": "string",
-                "required": True,
-                "coerce": str,
-                "minlength": 16,
-                "maxlength": 16
-            },
-            "guild_id": {
-                "type": "string",
-                "required": True,
-                "coerce": str,
-                "maxlength": 50
-            }
-        }
-
-        validator = Validator(schema)
-        validator.validate(attempt_details)
-        verification_code = validator.document["verification_code"]
-        guild_id = validator.document["guild_id"]
+        ATTEMPT_VALIDATOR.validate(attempt_details)
 
-        if validator.errors:
-            raise Exception(f"Validation failed: {validator.errors}")
+        if ATTEMPT_VALIDATOR.errors:
+            raise Exception(f"Validation failed: {ATTEMPT_VALIDATOR.errors}")
 
         return True
 
@@ -1,16 +1,56 @@
-from smtplib import SMTP
-from typing import Tuple
+from __future__ import annotations
+
+import re
+from typing import Pattern, Tuple
 
 from cerberus import Validator  # type: ignore
-from requests import post
 
 from ...logger import get_logger
+from ..util import probe
 from ..util.config import CONFIG
 
 logger = get_logger(__name__)
 
 
+def _compile_regex(pattern: str) -> Pattern:
+    # Anchor the end the same way cerberus' regex rule does
+    if not pattern.endswith("$"):
+        pattern += "$"
+    return re.compile(pattern)
+
+
+VALID_EMAIL_REGEX = _compile_regex(CONFIG["DEFAULT"]["valid_email_regex"])
+INVALID_EMAIL_REGEX = _compile_regex(CONFIG["DEFAULT"]["invalid_email_regex"])
+
+
+def _check_address_regexes(field: str, value: str, error) -> None:
+    """Precompiled equivalent of the regex and noneof-regex rules"""
+    if not VALID_EMAIL_REGEX.match(value):
+        error(field,
+              f"value does not match regex '{VALID_EMAIL_REGEX.pattern}'")
+    elif INVALID_EMAIL_REGEX.match(value):
+        error(field,
+              f"value matches invalid regex '{INVALID_EMAIL_REGEX.pattern}'")
+
+
+EMAIL_SCHEMA = {
+    "address": {
+        "type": "string",
+        "required": True,
+        "coerce": str,
+        "minlength": 11,
+        "maxlength": 100,
+        "check_with": _check_address_regexes
+    }
+}
+EMAIL_VALIDATOR = Validator(EMAIL_SCHEMA)
+
+
 class Email:
+    __slots__ = ("address", )
+
+    address: str
+
     def __init__(self, address: str):
         valid, address = Email.validate(address)
 
@@ -18,76 +58,43 @@ class Email:
             self.address = address
 
     @staticmethod
-    def validate(address: str) -> Tuple[bool, str]:
-
-        valid_regex = CONFIG["DEFAULT"]["valid_email_regex"]
-        invalid_regex = CONFIG["DEFAULT"]["invalid_email_regex"]
-
-        schema = {
-            "address": {
-                "type": "string",
-                "required": True,
-                "coerce": str,
-                "minlength": 11,
-                "maxlength": 100,
-                "regex": valid_regex,
-                "noneof": [{
-                    "regex": invalid_regex
-                }]
-            }
-        }
-
-        validator = Validator(schema)
-        result = validator.validate({"address": address})
-        address = validator.document["address"]
-        if validator.errors:
-            raise Exception(f"Validation failed: {validator.errors}")
-            logger.info(f'Invalid Email: {address}')
+    def from_trusted(address: str) -> Email:
+        """Wrap an address that was already validated, e.g. one read back from
+        the db, without validating or probing it again
+        """
+        email = Email.__new__(Email)
+        email.address = address
 
-        student = address.split("@")[1] == CONFIG["DEFAULT"]["student_domain"]
-
-        if student and not Email.student_address_exists(address):
-            raise Exception(f"Email address does not exist: {address=}")
-        elif not student and not Email.staff_address_exists(address):
-            raise Exception(f"Email address does not exist: {address=}")
-
-        return result, address
+        return email
 
     @staticmethod
-    def student_address_exists(email_address: str) -> bool:
+    async def from_user_input(address: str) -> Email:
+        """Validate an address and check that the mailbox exists
 
-        # AWS blocks outbound port 25 and requires a request to open it up
-        if CONFIG['DEFAULT']['aws_instance']:
-            return True
+        Raises:
+            Exception: If the address is invalid or does not exist
+        """
+        email = Email(address)
+        await email.ensure_exists()
 
-        smtp = SMTP(CONFIG["DEFAULT"]["student_mail_server"])
-        smtp.ehlo()
-        smtp.docmd("MAIL", "FROM:<>")
-        resp_code, _ = smtp.docmd("RCPT", f"TO:<{email_address}>")
+        return email
 
-        if resp_code != 250:
-            return False
-        else:
-            return True
+    async def ensure_exists(self) -> None:
+        """Check that the mailbox exists
+
+        Raises:
+            Exception: If the address does not exist
+        """
+        if not await probe.address_exists(self.address):
+            raise Exception(
+                f"Email address does not exist: address={self.address!r}")
 
     @staticmethod
-    def staff_address_exists(email_address: str) -> bool:
-        split = email_address.split(".")
-        first_name = split[0]
-        last_name = split[1]
-
-        url = CONFIG["DEFAULT"]["staff_search_url"]
-        request_json = {
-            "search_by_name": True,
-            "search_by_position": False,
-            "search_term": f"{first_name} {last_name}"
-        }
-        res = post(url, json=request_json)
-
-        staff_members = res.json()["staff"]
-
-        emails = []
-        for member in staff_members:
-            emails.append(member["email_address"])
-
-        return email_address in emails
+    def validate(address: str) -> Tuple[bool, str]:
+        result = EMAIL_VALIDATOR.validate({"address": address})
+        address = EMAIL_VALIDATOR.document["address"]
+        if EMAIL_VALIDATOR.errors:
+            raise Exception(f"Validation failed: {EMAIL_VALIDATOR.errors}")
+            logger.info(f'Invalid Email: {address}')
+
+        return result, address
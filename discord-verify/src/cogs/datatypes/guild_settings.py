@@ -0,0 +1,36 @@
+from __future__ import annotations
+
+from typing import Dict
+
+
+class GuildSettings:
+    guild_id: str
+    verify_channel_id: str
+    exec_role_id: str
+    verified_role_id: str
+    # Integer forms of the ids for cheap comparisons against discord objects.
+    # 0 when unset.
+    verify_channel: int
+    exec_role: int
+
+    def __init__(self,
+                 guild_id: str,
+                 verify_channel_id: str = "",
+                 exec_role_id: str = "",
+                 verified_role_id: str = ""):
+        self.guild_id = guild_id
+        self.verify_channel_id = verify_channel_id
+        self.exec_role_id = exec_role_id
+        self.verified_role_id = verified_role_id
+
+        self.verify_channel = int(verify_channel_id or 0)
+        self.exec_role = int(exec_role_id or 0)
+
+    @staticmethod
+    def from_dict(guild_id: str, settings: Dict[str, str]) -> GuildSettings:
+        return GuildSettings(guild_id,
+                             verify_channel_id=settings.get(
+                                 "verify_channel_id", ""),
+                             exec_role_id=settings.get("exec_role_id", ""),
+                             verified_role_id=settings.get(
+                                 "verified_role_id", ""))
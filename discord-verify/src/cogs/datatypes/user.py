@@ -1,7 +1,5 @@
 from __future__ import annotations
 
-import copy
-import datetime
 from typing import Dict, List, Optional, Tuple
 
 from cerberus import TypeDefinition, Validator  # type: ignore
@@ -12,8 +10,33 @@ from .attempt import Attempt
 attempt_type = TypeDefinition("attempt", (Attempt, ), ())
 Validator.types_mapping["attempt"] = attempt_type
 
+USER_SCHEMA = {
+    "user_id": {
+        "type": "string",
+        "required": True,
+        "coerce": str,
+        "minlength": 10,
+        "maxlength": 20
+    },
+    "name": {
+        "type": "string",
+        "required": True
+    },
+    "discriminator": {
+        "type": "string",
+        "required": True,
+        "coerce": str
+    },
+    "status": {
+        "type": "string"
+    }
+}
+USER_VALIDATOR = Validator(USER_SCHEMA)
+
 
 class User:
+    __slots__ = ("user_id", "name", "discriminator", "status", "attempts")
+
     user_id: str
     name: str
     discriminator: str
@@ -25,7 +48,7 @@ class User:
                  name: str,
                  discriminator: str,
                  status: str,
-                 attempts: list = []):
+                 attempts: Optional[List[Attempt]] = None):
 
         user_details = {
             "user_id": user_id,
@@ -36,57 +59,45 @@ class User:
 
         valid, user_details = User.validate(user_details)
         if valid:
-            self.user_id: str = user_details["user_id"]
-            self.name: str = user_details["name"]
-            self.discriminator: str = user_details["discriminator"]
+            self.user_id = user_details["user_id"]
+            self.name = user_details["name"]
+            self.discriminator = user_details["discriminator"]
             self.status = user_details["status"]
 
-        if attempts:
-            self.attempts: List[Attempt] = attempts
-        else:
-            self.attempts: List[Attempt] = []
+        self.attempts = attempts if attempts else []
 
     @staticmethod
     def to_dict(user: User) -> Dict:
-        user_copy = copy.deepcopy(user)
-        if user_copy.attempts:
-            user_copy.attempts = [
-                Attempt.to_dict(  # type: ignore
-                    attempt) for attempt in user_copy.attempts
-            ]
+        return {
+            "user_id": user.user_id,
+            "name": user.name,
+            "discriminator": user.discriminator,
+            "status": user.status,
+            "attempts": [Attempt.to_dict(attempt) for attempt in user.attempts]
+        }
 
-        return vars(user_copy)
+    @staticmethod
+    def from_dict(user_dict: Dict) -> User:
+        """Rebuild a stored user and their attempts without validation"""
+        user = User.__new__(User)
+        user.user_id = user_dict["user_id"]
+        user.name = user_dict["name"]
+        user.discriminator = user_dict["discriminator"]
+        user.status = user_dict["status"]
+        user.attempts = [
+            Attempt.from_dict(attempt_dict)
+            for attempt_dict in user_dict.get("attempts", [])
+        ]
+
+        return user
 
     @staticmethod
     def validate(user_details: dict) -> Tuple[bool, Dict]:
 
-        schema = {
-            "user_id": {
-                "type": "string",
-                "required": True,
-                "coerce": str,
-                "minlength": 10,
-                "maxlength": 20
-            },
-            "name": {
-                "type": "string",
-                "required": True
-            },
-            "discriminator": {
-                "type": "string",
-                "required": True,
-                "coerce": str
-            },
-            "status": {
-                "type": "string"
-            }
-        }
-
-        validator = Validator(schema)
-        result = validator.validate(user_details)
-        user_details = validator.document
-        if validator.errors:
-            raise Exception(f"Validation failed: {validator.errors}")
+        result = USER_VALIDATOR.validate(user_details)
+        user_details = USER_VALIDATOR.document
+        if USER_VALIDATOR.errors:
+            raise Exception(f"Validation failed: {USER_VALIDATOR.errors}")
 
         return result, user_details
 
@@ -94,32 +105,20 @@ class User:
         self.attempts.append(attempt)
 
     def get_earliest_attempt(self) -> Optional[Attempt]:
-        earliest_attempt = None
-        earliest_time = datetime.datetime.max
+        # Attempts are appended in time order
+        return self.attempts[0] if self.attempts else None
 
-        if self.attempts:
-            for attempt in self.attempts:
-                current_time = datetime.datetime.fromisoformat(
-                    attempt.attempt_time)
-                if current_time < earliest_time:
-                    earliest_time = current_time
-                    earliest_attempt = attempt
+    def get_latest_attempt(self) -> Optional[Attempt]:
+        return self.attempts[-1] if self.attempts else None
 
-        return earliest_attempt
+    def get_attempt(self, verification_code: str,
+                    guild_id: str) -> Optional[Attempt]:
+        for attempt in reversed(self.attempts):
+            if (attempt.verification_code == verification_code
+                    and attempt.guild_id == guild_id):
+                return attempt
 
-    def get_latest_attempt(self) -> Optional[Attempt]:
-        latest_attempt = None
-        latest_time = datetime.datetime.min
-
-        if self.attempts:
-            for attempt in self.attempts:
-                current_time = datetime.datetime.fromisoformat(
-                    attempt.attempt_time)
-                if current_time > latest_time:
-                    latest_time = current_time
-                    latest_attempt = attempt
-
-        return latest_attempt
+        return None
 
     def verify_attempt(self, verification_code: str) -> bool:
         for attempt in self.attempts:
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import asyncio
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from pymongo import CursorType  # type: ignore
+from pymongo.errors import CollectionInvalid, PyMongoError  # type: ignore
+
+from ...logger import get_logger
+from ..util.config import CONFIG
+from . import db
+
+logger = get_logger(__name__)
+
+BROKER_CONFIG = CONFIG["DEFAULT"]
+
+# Identifies this process's own events so they aren't handled twice
+ORIGIN = uuid.uuid4().hex
+
+# Wait this long before reconnecting a dropped subscription
+RETRY_SECONDS = 5
+
+Handler = Callable[[str], None]
+
+
+class LocalBroker:
+    """Delivers events to handlers in this process only. Enough for a single
+    process, where every change is already made locally.
+    """
+    def __init__(self):
+        self._handlers: Dict[str, List[Handler]] = defaultdict(list)
+
+    def subscribe(self, kind: str, handler: Handler) -> None:
+        self._handlers[kind].append(handler)
+
+    async def publish(self, kind: str, key: str) -> None:
+        pass
+
+    def _dispatch(self, event: Dict) -> None:
+        if event.get("origin") == ORIGIN:
+            return
+
+        for handler in self._handlers.get(event.get("kind"), []):
+            try:
+                handler(event["key"])
+            except Exception as e:
+                logger.error(f"Broker handler for {event['kind']} failed: {e}")
+
+    def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+class MongoBroker(LocalBroker):
+    """Fans events out to every process sharing the db
+
+    Events are inserted into the broker_events collection. With
+    use_change_stream, processes watch it with a change stream, which needs
+    Mongo to run as a replica set. Otherwise the collection is capped and
+    tailed, which works on a standalone server. Handlers must be idempotent:
+    after a reconnect recent events may be delivered again.
+
+    A capped collection bounds itself. For change streams, events expire
+    after event_ttl_seconds instead.
+    """
+    def __init__(self, use_change_stream: bool, capped_size: int,
+                 event_ttl_seconds: int):
+        super().__init__()
+        self.use_change_stream = use_change_stream
+        self.capped_size = capped_size
+        self.event_ttl_seconds = event_ttl_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    def _collection(self):
+        return db.get_db().get_collection("broker_events")
+
+    async def publish(self, kind: str, key: str) -> None:
+        try:
+            await self._collection().insert_one({
+                "kind": kind,
+                "key": key,
+                "origin": ORIGIN,
+                "at": datetime.now(timezone.utc)
+            })
+        except PyMongoError as e:
+            logger.error(f"Failed to publish {kind} {key}: {e}")
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if self.use_change_stream:
+                    await db.ensure_ttl_index(self._collection(), "at",
+                                              self.event_ttl_seconds)
+                    await self._watch()
+                else:
+                    await self._ensure_capped()
+                    await self._tail()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Broker subscription failed, retrying: {e}")
+
+            await asyncio.sleep(RETRY_SECONDS)
+
+    async def _ensure_capped(self) -> None:
+        try:
+            await db.get_db().create_collection("broker_events",
+                                                capped=True,
+                                                size=self.capped_size)
+        except CollectionInvalid:
+            pass
+
+        # A tailable cursor on an empty collection dies straight away
+        await self.publish("hello", ORIGIN)
+
+    async def _watch(self) -> None:
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        async with self._collection().watch(pipeline) as stream:
+            async for change in stream:
+                self._dispatch(change["fullDocument"])
+
+    async def _tail(self) -> None:
+        # Replaying a few seconds covers events published while reconnecting
+        since = datetime.now(timezone.utc) - timedelta(seconds=RETRY_SECONDS)
+        cursor = self._collection().find(
+            {"at": {
+                "$gte": since
+            }}, cursor_type=CursorType.TAILABLE_AWAIT)
+        while cursor.alive:
+            async for event in cursor:
+                self._dispatch(event)
+
+
+def _from_config():
+    kind = BROKER_CONFIG.get("broker", fallback="local")
+    if kind == "local":
+        return LocalBroker()
+
+    return MongoBroker(use_change_stream=kind == "changestream",
+                       capped_size=BROKER_CONFIG.getint(
+                           "broker_capped_bytes", fallback=1024 * 1024),
+                       event_ttl_seconds=BROKER_CONFIG.getint(
+                           "broker_event_ttl_seconds", fallback=3600))
+
+
+bus = _from_config()
@@ -1,48 +1,102 @@
 from __future__ import annotations
 
+import re
+from datetime import datetime, timezone
 from os import environ
-from typing import Dict, List, Optional, Union
+from typing import (Any, AsyncIterator, Dict, List, Optional, Set, Tuple,
+                    Union)
 
 # import discord  # type: ignore
-from discord import Guild, Member  # type: ignore
-from pymongo import MongoClient  # type: ignore
+from motor.motor_asyncio import (AsyncIOMotorClient,  # type: ignore
+                                 AsyncIOMotorCollection, AsyncIOMotorDatabase)
+from pymongo import ASCENDING, DeleteOne, UpdateOne  # type: ignore
+from pymongo.errors import DuplicateKeyError, OperationFailure  # type: ignore
 
 from ...logger import get_logger
-from ..datatypes.attempt import Attempt
+from ..datatypes.attempt import Attempt, parse_attempt_time
 from ..datatypes.email_address import Email
 from ..datatypes.user import User
 from ..util.config import CONFIG
+from . import metrics
 
 logger = get_logger(__name__)
-logger.info("Waiting for DB connection.")
+# The client is made on first use, so importing this module doesn't connect
+_client: Optional[AsyncIOMotorClient] = None
 
-db_host = environ["DB_HOST"]
-client = MongoClient(host=db_host)
 
-try:
-    if environ["DROP_DATABASE"] == "1":
-        client.drop_database("discord_email_verification_bot_db")
-except KeyError:
-    logger.info("Keeping existing database")
+def get_client() -> AsyncIOMotorClient:
+    global _client
+    if _client is None:
+        logger.info("Waiting for DB connection.")
+        # tz_aware so stored attempt times come back as UTC datetimes
+        _client = AsyncIOMotorClient(host=environ["DB_HOST"], tz_aware=True)
 
-db = client.get_database(CONFIG["DEFAULT"]["db_name"])
-waiting_collection = db.get_collection("waiting_for_verify")
+    return _client
 
 
-def set_exec_role(guild_id: str, role_id: str) -> bool:
-    collection = db.get_collection(str(guild_id))
-    existing_role_id: str = get_exec_role(guild_id)
+def get_db() -> AsyncIOMotorDatabase:
+    return get_client().get_database(CONFIG["DEFAULT"]["db_name"])
 
-    if existing_role_id:
-        return False
+
+def get_guild_collection(guild_id: str) -> AsyncIOMotorCollection:
+    return get_db().get_collection(str(guild_id))
+
+
+def get_waiting_collection() -> AsyncIOMotorCollection:
+    return get_db().get_collection("waiting_for_verify")
+
+
+def get_verified_emails_collection() -> AsyncIOMotorCollection:
+    return get_db().get_collection("verified_emails")
+
+
+def get_rate_limits_collection() -> AsyncIOMotorCollection:
+    return get_db().get_collection("rate_limits")
+
+
+async def connect() -> None:
+    """Connect and drop the database first if DROP_DATABASE=1"""
+    if environ.get("DROP_DATABASE") == "1":
+        await get_client().drop_database(CONFIG["DEFAULT"]["db_name"])
+        logger.info("Dropped the database")
     else:
-        collection.insert_one({'_id': 'exec_role_id', 'id': str(role_id)})
-        return True
+        await get_client().admin.command("ping")
+        logger.info("Keeping existing database")
+
+
+# Raised when an index exists with different options, e.g. a changed TTL
+INDEX_OPTIONS_CONFLICT = 85
+
+# Guild collections whose indexes have been ensured by this process
+_indexed_guilds: Set[str] = set()
 
 
-def get_exec_role(guild_id: str) -> str:
-    collection = db.get_collection(str(guild_id))
-    res = collection.find_one({"_id": "exec_role_id"})
+@metrics.db_op
+async def _set_guild_setting_once(guild_id: str, setting: str,
+                                 value: str) -> bool:
+    """Atomically set a guild setting unless it is already set
+
+    Returns:
+        bool: True if the setting was written
+    """
+    collection = get_guild_collection(guild_id)
+    res = await collection.update_one({"_id": setting},
+                                      {"$setOnInsert": {
+                                          "id": str(value)
+                                      }},
+                                      upsert=True)
+
+    return res.upserted_id is not None
+
+
+async def set_exec_role(guild_id: str, role_id: str) -> bool:
+    return await _set_guild_setting_once(guild_id, "exec_role_id", role_id)
+
+
+@metrics.db_op
+async def get_exec_role(guild_id: str) -> str:
+    collection = get_guild_collection(guild_id)
+    res = await collection.find_one({"_id": "exec_role_id"})
 
     if res:
         channel_id = res['id']
@@ -51,24 +105,15 @@ def get_exec_role(guild_id: str) -> str:
         return ''
 
 
-def set_verify_channel(guild_id: str, channel_id: str) -> bool:
-    collection = db.get_collection(str(guild_id))
-
-    existing_channel_id = get_verify_channel(guild_id)
+async def set_verify_channel(guild_id: str, channel_id: str) -> bool:
+    return await _set_guild_setting_once(guild_id, "verify_channel_id",
+                                         channel_id)
 
-    if existing_channel_id:
-        return False
-    else:
-        collection.insert_one({
-            '_id': 'verify_channel_id',
-            'id': str(channel_id)
-        })
-        return True
 
-
-def get_verify_channel(guild_id: str) -> str:
-    collection = db.get_collection(str(guild_id))
-    res = collection.find_one({"_id": "verify_channel_id"})
+@metrics.db_op
+async def get_verify_channel(guild_id: str) -> str:
+    collection = get_guild_collection(guild_id)
+    res = await collection.find_one({"_id": "verify_channel_id"})
 
     if res:
         channel_id = res['id']
@@ -77,19 +122,14 @@ def get_verify_channel(guild_id: str) -> str:
         return ''
 
 
-def set_verified_role_id(guild_id: str, role_id: str) -> None:
-    collection = db.get_collection(str(guild_id))
-    existing_role_id = get_verified_role_id(guild_id)
-
-    if existing_role_id:
-        return
-    else:
-        collection.insert_one({"_id": "verified_role_id", "id": str(role_id)})
+async def set_verified_role_id(guild_id: str, role_id: str) -> None:
+    await _set_guild_setting_once(guild_id, "verified_role_id", role_id)
 
 
-def get_verified_role_id(guild_id: str) -> str:
-    collection = db.get_collection(str(guild_id))
-    res = collection.find_one({"_id": "verified_role_id"})
+@metrics.db_op
+async def get_verified_role_id(guild_id: str) -> str:
+    collection = get_guild_collection(guild_id)
+    res = await collection.find_one({"_id": "verified_role_id"})
 
     if res:
         role_id = res["id"]
@@ -98,73 +138,181 @@ def get_verified_role_id(guild_id: str) -> str:
         return ""
 
 
-def get_waiting_user_details(user_id: str) -> Optional[Dict]:
-    waiting_user = waiting_collection.find_one({"user_id": user_id})
+@metrics.db_op
+async def get_guild_settings(guild_id: str) -> Dict[str, str]:
+    """Fetch the exec role, verify channel and verified role in one query
+
+    Returns:
+        Dict[str, str]: Setting _id -> id, only for settings that are set
+    """
+    collection = get_guild_collection(guild_id)
+    cursor = collection.find({
+        "_id": {
+            "$in": ["exec_role_id", "verify_channel_id", "verified_role_id"]
+        }
+    })
+
+    return {doc["_id"]: doc["id"] async for doc in cursor}
+
+
+@metrics.db_op
+async def get_guild_ids() -> List[str]:
+    """Ids of every guild with a collection"""
+    return [
+        name for name in await get_db().list_collection_names()
+        if name.isdigit()
+    ]
+
+
+@metrics.db_op
+async def get_waiting_user_details(user_id: str) -> Optional[Dict]:
+    waiting_user = await get_waiting_collection().find_one(
+        {"user_id": user_id})
 
     return waiting_user
 
 
-def save_user(user: User, guild_id: str) -> None:
-    collection = db.get_collection(str(guild_id))
-    existing_user = collection.find_one({"user_id": user.user_id})
+@metrics.db_op
+async def delete_user(user_id: str, guild_id: str) -> None:
+    collection = get_guild_collection(guild_id)
+    await collection.delete_one({"user_id": user_id})
+    await get_verified_emails_collection().delete_many({
+        "guild_id": str(guild_id),
+        "user_id": user_id
+    })
 
-    user_dict = User.to_dict(user)
-    if existing_user:
-        collection.replace_one({"user_id": user.user_id}, user_dict)
-    else:
-        collection.insert_one(user_dict)
-
-
-def delete_user(user_id: str, guild_id: str) -> None:
-    collection = db.get_collection(str(guild_id))
-    collection.delete_one({"user_id": user_id})
-    collection.delete_one({
-        "_id": "guild_emails",
-        "emails": {
-            "$elemMatch": {
-                "user_id": {
-                    "$eq": user_id
-                }
+
+def user_updates(user: User, stored: List[str]) -> List[UpdateOne]:
+    """Build the writes that bring a stored user up to date
+
+    stored holds the statuses of the attempts the db already has, in order.
+    Attempts are only ever appended, so the rest are pushed and, of the
+    stored ones, only the statuses that changed are set. The status updates
+    go in their own request, as Mongo won't push to and set inside the
+    attempts array in one update.
+    """
+    user_filter = {"user_id": user.user_id}
+    requests = []
+
+    changed_statuses = {
+        f"attempts.{i}.status": attempt.status
+        for i, (attempt, status) in enumerate(zip(user.attempts, stored))
+        if attempt.status != status
+    }
+    if changed_statuses:
+        requests.append(UpdateOne(user_filter, {"$set": changed_statuses}))
+
+    update: Dict[str, Any] = {
+        "$set": {
+            "name": user.name,
+            "discriminator": user.discriminator,
+            "status": user.status
+        }
+    }
+    new_attempts = user.attempts[len(stored):]
+    if new_attempts:
+        update["$push"] = {
+            "attempts": {
+                "$each":
+                [Attempt.to_dict(attempt) for attempt in new_attempts]
             }
         }
-    })
+    requests.append(UpdateOne(user_filter, update, upsert=True))
 
+    return requests
 
-def add_to_waiting(user: User, guild_id: str) -> None:
-    waiting_user = waiting_collection.find_one({"user_id": user.user_id})
 
-    if not waiting_user:
-        waiting_collection.insert_one({
-            "user_id": user.user_id,
-            "guild_id": guild_id,
-            "name": user.name,
-            "discriminator": user.discriminator
-        })
-    else:
-        waiting_collection.replace_one({"user_id": user.user_id}, {
-            "user_id": user.user_id,
+@metrics.db_op
+async def save_user_updates(requests: List[UpdateOne], guild_id: str) -> None:
+    """Write the user_updates for several users of one guild in a single
+    bulk write
+    """
+    if not requests:
+        return
+
+    await ensure_guild_indexes(str(guild_id))
+    collection = get_guild_collection(guild_id)
+
+    await collection.bulk_write(requests, ordered=False)
+
+
+@metrics.db_op
+async def mark_users_verified(users: List[User], guild_id: str) -> None:
+    """Upsert several users as verified in one bulk write, keeping any
+    attempts they already have
+    """
+    if not users:
+        return
+
+    await ensure_guild_indexes(str(guild_id))
+    collection = get_guild_collection(guild_id)
+
+    requests = []
+    for user in users:
+        update = {
+            "$set": {
+                "name": user.name,
+                "discriminator": user.discriminator,
+                "status": "verified"
+            },
+            "$setOnInsert": {
+                "attempts": []
+            }
+        }
+        requests.append(
+            UpdateOne({"user_id": user.user_id}, update, upsert=True))
+
+    await collection.bulk_write(requests, ordered=False)
+
+
+@metrics.db_op
+async def update_waiting(add: List[Tuple[User, str]],
+                         remove: List[str]) -> None:
+    """Add (user, guild_id) pairs to and remove user ids from the waiting
+    collection in a single bulk write
+    """
+    requests: List[Union[UpdateOne, DeleteOne]] = []
+    for user, guild_id in add:
+        waiting_details = {
             "guild_id": guild_id,
             "name": user.name,
-            "discriminator": user.discriminator
-        })
+            "discriminator": user.discriminator,
+            "created_at": datetime.now(timezone.utc)
+        }
+        requests.append(
+            UpdateOne({"user_id": user.user_id}, {"$set": waiting_details},
+                      upsert=True))
+    for user_id in remove:
+        requests.append(DeleteOne({"user_id": user_id}))
 
+    if requests:
+        await get_waiting_collection().bulk_write(requests, ordered=False)
 
-def remove_from_waiting(user_id: str) -> None:
-    waiting_collection.delete_one({"user_id": user_id})
 
+async def get_waiting_users() -> AsyncIterator[Tuple[Dict, Optional[User]]]:
+    """Yield every waiting entry with its user from the guild collection"""
+    async for waiting_user in get_waiting_collection().find():
+        user = await get_user(user_id=waiting_user["user_id"],
+                              guild_id=waiting_user["guild_id"])
+        yield waiting_user, user
 
-def get_user(user_id: str, guild_id="", user_details={}) -> Optional[User]:
+
+@metrics.db_op
+async def get_user(user_id: str,
+                   guild_id="",
+                   user_details={}) -> Optional[User]:
     user_dict = {}
 
     if guild_id:
-        guild_collection = db.get_collection(str(guild_id))
-        user_dict = guild_collection.find_one({"user_id": user_id})
+        guild_collection = get_guild_collection(guild_id)
+        user_dict = await guild_collection.find_one({"user_id": user_id})
     else:
-        waiting_user = waiting_collection.find_one({"user_id": user_id})
+        waiting_user = await get_waiting_collection().find_one(
+            {"user_id": user_id})
         if waiting_user:
             guild_id = waiting_user["guild_id"]
-            guild_collection = db.get_collection(str(guild_id))
-            user_dict = guild_collection.find_one({"user_id": user_id})
+            guild_collection = get_guild_collection(guild_id)
+            user_dict = await guild_collection.find_one({"user_id": user_id})
 
     if user_dict:
         return initialise_user_from_dict(user_dict)
@@ -173,125 +321,440 @@ def get_user(user_id: str, guild_id="", user_details={}) -> Optional[User]:
 
 
 def create_user(user_id: str, guild_id="", user_details={}) -> User:
-    return initialise_user_from_dict(user_details)
+    return User(user_details["user_id"], user_details["name"],
+                user_details["discriminator"], user_details["status"])
 
 
-def get_user_raw(user_id: str, guild_id: str) -> Optional[Dict]:
-    collection = db.get_collection(str(guild_id))
-    return collection.find_one({"user_id": user_id})
+@metrics.db_op
+async def get_user_raw(user_id: str, guild_id: str) -> Optional[Dict]:
+    collection = get_guild_collection(guild_id)
+    return await collection.find_one({"user_id": user_id})
 
 
 def initialise_user_from_dict(user_dict: dict) -> User:
+    """Rebuild a user read from the db. The data was validated before it was
+    stored, so this skips validation and never probes the email addresses.
+    """
+    return User.from_dict(user_dict)
+
+
+def verified_members_filter(guild_id: str,
+                            email_prefix: str = "",
+                            user_ids: Optional[List[str]] = None
+                            ) -> Dict[str, Any]:
+    """Build a verified_emails filter for a guild
+
+    Both searches are served by the guild's indexes: an anchored email prefix
+    by (guild_id, email), user ids by (guild_id, user_id). If both are given
+    either may match.
+    """
+    searches: List[Dict[str, Any]] = []
+    if email_prefix:
+        searches.append(
+            {"email": {
+                "$regex": f"^{re.escape(email_prefix)}"
+            }})
+    if user_ids is not None:
+        searches.append({"user_id": {"$in": user_ids}})
+
+    query: Dict[str, Any] = {"guild_id": str(guild_id)}
+    if len(searches) == 1:
+        query.update(searches[0])
+    elif searches:
+        query["$or"] = searches
+
+    return query
+
+
+@metrics.db_op
+async def count_verified_members(query: Dict[str, Any]) -> int:
+    return await get_verified_emails_collection().count_documents(query)
+
+
+@metrics.db_op
+async def get_verified_members_page(query: Dict[str, Any],
+                                    limit: int,
+                                    after_email: Optional[str] = None,
+                                    skip: int = 0) -> List[Dict[str, str]]:
+    """Fetch one page of verified members ordered by email
+
+    Pages following a known one should pass its last email as after_email,
+    which is a range scan on the index. Otherwise skip is used.
+
+    Returns:
+        List[Dict[str, str]]: {"user_id": str, "email": str} per member
+    """
+    if after_email is not None:
+        query = {"$and": [query, {"email": {"$gt": after_email}}]}
+        skip = 0
+
+    cursor = get_verified_emails_collection().find(
+        query,
+        projection={
+            "_id": False,
+            "user_id": True,
+            "email": True
+        },
+        sort=[("email", ASCENDING)],
+        skip=skip,
+        limit=limit)
+
+    return await cursor.to_list(length=limit)
+
+
+@metrics.db_op
+async def add_verified_email(user_id: str, email: Email,
+                             guild_id: str) -> None:
     try:
-        attempts_dicts: List[Dict] = user_dict["attempts"]
-        attempts = []
-        for attempt_dict in attempts_dicts:
-            verification_code: str = attempt_dict["verification_code"]
-            guild_id: str = attempt_dict["guild_id"]
-            email: str = attempt_dict["email"]
-            attempt_time: str = attempt_dict["attempt_time"]
-
-            attempt: Attempt = Attempt(verification_code,
-                                       guild_id,
-                                       email=Email(email),
-                                       attempt_time=attempt_time)
-
-            attempts.append(attempt)
-
-        return User(user_dict["user_id"],
-                    user_dict["name"],
-                    user_dict["discriminator"],
-                    user_dict["status"],
-                    attempts=attempts)
-    except KeyError:
-        logger.info("User has no current attempts")
-
-    return User(user_dict["user_id"], user_dict["name"],
-                user_dict["discriminator"], user_dict["status"])
-
-
-def get_verified_attempt(user_id: str, guild_id: str,
-                         verification_code: str) -> Optional[Attempt]:
-    guild_collection = db.get_collection(str(guild_id))
-    target = {
-        "user_id": user_id,
-        "attempts": {
-            "$elemMatch": {
-                "verification_code": verification_code
+        await get_verified_emails_collection().update_one(
+            {
+                "guild_id": str(guild_id),
+                "email": email.address
+            }, {
+                "$setOnInsert": {
+                    "user_id": user_id,
+                    "verified_at": datetime.now(timezone.utc)
+                }
+            },
+            upsert=True)
+    except DuplicateKeyError:
+        # A concurrent verification inserted the same email first
+        logger.warning(f"{email.address} already verified in {guild_id}")
+
+
+@metrics.db_op
+async def get_email_owners(addresses: List[str],
+                           guild_id: str) -> Dict[str, str]:
+    """Map each already verified address in `addresses` to its user_id"""
+    cursor = get_verified_emails_collection().find(
+        {
+            "guild_id": str(guild_id),
+            "email": {
+                "$in": addresses
+            }
+        },
+        projection={
+            "email": True,
+            "user_id": True
+        })
+
+    return {d["email"]: d["user_id"] async for d in cursor}
+
+
+@metrics.db_op
+async def add_verified_emails(entries: List[Tuple[str, str]],
+                              guild_id: str) -> int:
+    """Record several (user_id, email address) pairs in one bulk write
+
+    Returns:
+        int: How many emails were newly recorded
+    """
+    if not entries:
+        return 0
+
+    now = datetime.now(timezone.utc)
+    requests = []
+    for user_id, address in entries:
+        target = {"guild_id": str(guild_id), "email": address}
+        update = {"$setOnInsert": {"user_id": user_id, "verified_at": now}}
+        requests.append(UpdateOne(target, update, upsert=True))
+
+    res = await get_verified_emails_collection().bulk_write(requests,
+                                                            ordered=False)
+
+    return res.upserted_count
+
+
+async def iter_guild_records(
+        guild_id: str,
+        since: Optional[datetime] = None,
+        batch_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+    """Stream a guild's users with their verified emails and attempts
+
+    Documents come from a server-side cursor, so only one batch is in memory
+    at a time. Verification codes are left out.
+
+    Args:
+        guild_id (str): The guild to export
+        since (Optional[datetime]): Only include users verified or with
+            attempts at or after this time, and only those attempts
+        batch_size (int): Documents per cursor batch
+
+    Yields:
+        Dict[str, Any]: user_id, name, discriminator, status, emails
+        ({"email", "verified_at"}) and attempts ({"attempt_time", "status",
+        "email"})
+    """
+    attempts: Dict[str, Any] = {
+        "$filter": {
+            "input": {
+                "$ifNull": ["$attempts", []]
+            },
+            "as": "attempt",
+            "cond": {
+                "$eq": ["$$attempt.guild_id", str(guild_id)]
             }
         }
     }
-    verified_user_dict = guild_collection.find_one(target)
+    if since is not None:
+        attempts["$filter"]["cond"] = {
+            "$and": [
+                attempts["$filter"]["cond"], {
+                    "$gte": ["$$attempt.attempt_time", since]
+                }
+            ]
+        }
 
-    if verified_user_dict:
-        attempts_dicts: List[Dict] = verified_user_dict["attempts"]
+    pipeline: List[Dict[str, Any]] = [{
+        "$match": {
+            "user_id": {
+                "$exists": True
+            }
+        }
+    }, {
+        "$lookup": {
+            "from": get_verified_emails_collection().name,
+            "localField": "user_id",
+            "foreignField": "user_id",
+            "as": "emails"
+        }
+    }, {
+        "$project": {
+            "_id": False,
+            "user_id": True,
+            "name": True,
+            "discriminator": True,
+            "status": True,
+            "emails": {
+                "$filter": {
+                    "input": "$emails",
+                    "as": "email",
+                    "cond": {
+                        "$eq": ["$$email.guild_id", str(guild_id)]
+                    }
+                }
+            },
+            "attempts": attempts
+        }
+    }, {
+        "$project": {
+            "emails._id": False,
+            "emails.guild_id": False,
+            "emails.user_id": False,
+            "attempts.guild_id": False,
+            "attempts.verification_code": False
+        }
+    }]
+    if since is not None:
+        pipeline.append({
+            "$match": {
+                "$or": [{
+                    "emails.verified_at": {
+                        "$gte": since
+                    }
+                }, {
+                    "attempts.0": {
+                        "$exists": True
+                    }
+                }]
+            }
+        })
 
-        attempts = []
-        for attempt_dict in attempts_dicts:
-            verification_code = attempt_dict["verification_code"]
-            guild_id = attempt_dict["guild_id"]
-            email_address: str = attempt_dict["email"]
-            attempts.append(
-                Attempt(verification_code, guild_id, Email(email_address)))
+    cursor = get_guild_collection(guild_id).aggregate(pipeline,
+                                                        batchSize=batch_size)
+    async for record in cursor:
+        yield record
 
-        for attempt in attempts:
-            if attempt.verification_code == verification_code:
-                return attempt
 
-    return None
+@metrics.db_op
+async def email_exists_in_guild(email: Email, guild_id: str) -> bool:
+    match = await get_verified_emails_collection().find_one(
+        {
+            "guild_id": str(guild_id),
+            "email": email.address
+        },
+        projection={"_id": True})
 
+    if match:
+        return True
+    else:
+        return False
 
-def get_verified_members(
-        guild: Guild) -> Optional[List[Dict[str, Union[Member, str]]]]:
-    guild_collection = db.get_collection(str(guild.id))
-    existing_emails = guild_collection.find_one({"_id": "guild_emails"})
-    if existing_emails:
-        res = []
-        for d in existing_emails["emails"]:
-            user_id: str = d["user_id"]
-            email: str = d["email"]
-            member: Member = guild.get_member(int(user_id))
-            res.append({"member": member, "email": email})
 
-        return res
-    else:
-        return []
+async def ensure_schema() -> None:
+    """Create indexes and run one-shot data migrations. Safe to run on every
+    startup.
+    """
+    verified_emails_collection = get_verified_emails_collection()
+    await verified_emails_collection.create_index([("guild_id", ASCENDING),
+                                                   ("email", ASCENDING)],
+                                                  unique=True)
+    await verified_emails_collection.create_index([("guild_id", ASCENDING),
+                                                   ("user_id", ASCENDING)])
+    # Used by the export's $lookup from a guild's users
+    await verified_emails_collection.create_index("user_id")
+
+    waiting_collection = get_waiting_collection()
+    await remove_duplicate_waiting()
+    try:
+        await waiting_collection.create_index("user_id", unique=True)
+    except OperationFailure as e:
+        logger.error(f"Failed to index user_id for waiting users: {e}")
+    await ensure_ttl_index(
+        waiting_collection, "created_at",
+        int(CONFIG["DEFAULT"].getfloat("waiting_ttl_hours", fallback=24) *
+            3600))
 
+    await get_rate_limits_collection().create_index("expires_at",
+                                                    expireAfterSeconds=0)
 
-def add_verified_email(user_id: str, email: Email, guild_id: str) -> None:
-    guild_collection = db.get_collection(str(guild_id))
-    existing_emails = guild_collection.find_one({"_id": "guild_emails"})
+    await migrate_guild_emails()
+    await migrate_attempt_times()
 
-    if existing_emails:
-        existing_emails = existing_emails["emails"]
-        existing_emails.append({"user_id": user_id, "email": email.address})
-        guild_collection.replace_one({"_id": "guild_emails"}, {
-            "_id": "guild_emails",
-            "emails": existing_emails
-        })
-    else:
-        guild_collection.insert_one({
-            "_id":
-            "guild_emails",
-            "emails": [{
-                "user_id": user_id,
-                "email": email.address
-            }]
-        })
+    for guild_id in await get_guild_ids():
+        await ensure_guild_indexes(guild_id)
 
 
-def email_exists_in_guild(email: Email, guild_id: str):
-    guild_collection = db.get_collection(str(guild_id))
-    match = guild_collection.find_one({
-        "_id": "guild_emails",
-        "emails": {
-            "$elemMatch": {
-                "email": email.address
+async def ensure_ttl_index(collection: AsyncIOMotorCollection, field: str,
+                           seconds: int) -> None:
+    """Create a TTL index, or update its expiry if the config changed"""
+    try:
+        await collection.create_index(field, expireAfterSeconds=seconds)
+    except OperationFailure as e:
+        if e.code != INDEX_OPTIONS_CONFLICT:
+            raise
+
+        await get_db().command("collMod",
+                               collection.name,
+                               index={
+                                   "keyPattern": {
+                                       field: ASCENDING
+                                   },
+                                   "expireAfterSeconds": seconds
+                               })
+        logger.info(f"Updated the {field} TTL on {collection.name} to "
+                    f"{seconds}s")
+
+
+async def remove_duplicate_waiting() -> None:
+    """Keep only the newest waiting entry per user
+
+    Entries written before the unique user_id index existed may be
+    duplicated, which would stop the index from being built.
+    """
+    cursor = get_waiting_collection().aggregate([{
+        "$sort": {
+            "created_at": -1
+        }
+    }, {
+        "$group": {
+            "_id": "$user_id",
+            "ids": {
+                "$push": "$_id"
+            },
+            "count": {
+                "$sum": 1
             }
         }
-    })
+    }, {
+        "$match": {
+            "count": {
+                "$gt": 1
+            }
+        }
+    }])
 
-    if match:
-        return True
-    else:
-        return False
+    stale = []
+    async for duplicate in cursor:
+        stale.extend(duplicate["ids"][1:])
+
+    if stale:
+        await get_waiting_collection().delete_many({"_id": {"$in": stale}})
+        logger.info(f"Removed {len(stale)} duplicate waiting entries")
+
+
+async def ensure_guild_indexes(guild_id: str) -> None:
+    """Index user_id on a guild's collection, once per guild per process.
+
+    The index is partial because the guild settings documents in the same
+    collection have no user_id.
+    """
+    if guild_id in _indexed_guilds:
+        return
+
+    collection = get_guild_collection(guild_id)
+    try:
+        await collection.create_index(
+            "user_id",
+            unique=True,
+            partialFilterExpression={"user_id": {
+                "$exists": True
+            }})
+    except OperationFailure as e:
+        # Most likely duplicate user documents from before the index existed
+        logger.error(f"Failed to index user_id for guild {guild_id}: {e}")
+
+    _indexed_guilds.add(guild_id)
+
+
+async def migrate_guild_emails() -> None:
+    """Move the old per-guild guild_emails array documents into the
+    verified_emails collection
+    """
+    for guild_id in await get_db().list_collection_names():
+        if not guild_id.isdigit():
+            continue
+
+        guild_collection = get_guild_collection(guild_id)
+        existing_emails = await guild_collection.find_one(
+            {"_id": "guild_emails"})
+        if not existing_emails:
+            continue
+
+        requests = []
+        for d in existing_emails["emails"]:
+            target = {"guild_id": guild_id, "email": d["email"]}
+            update = {"$setOnInsert": {"user_id": d["user_id"]}}
+            requests.append(UpdateOne(target, update, upsert=True))
+        if requests:
+            await get_verified_emails_collection().bulk_write(requests,
+                                                              ordered=False)
+
+        await guild_collection.delete_one({"_id": "guild_emails"})
+        logger.info(
+            f"Migrated {len(requests)} verified emails for guild {guild_id}")
+
+
+async def migrate_attempt_times() -> None:
+    """Convert attempt times stored as local time strings to UTC datetimes,
+    keeping each user's attempts in time order
+    """
+    for guild_id in await get_db().list_collection_names():
+        if not guild_id.isdigit():
+            continue
+
+        guild_collection = get_guild_collection(guild_id)
+        cursor = guild_collection.find(
+            {"attempts.attempt_time": {
+                "$type": "string"
+            }},
+            projection={"attempts": True})
+
+        migrated = 0
+        async for user_dict in cursor:
+            attempts = user_dict["attempts"]
+            for attempt_dict in attempts:
+                attempt_dict["attempt_time"] = parse_attempt_time(
+                    attempt_dict.get("attempt_time"))
+            attempts.sort(key=lambda a: a["attempt_time"])
+
+            await guild_collection.update_one(
+                {"_id": user_dict["_id"]},
+                {"$set": {
+                    "attempts": attempts
+                }})
+            migrated += 1
+
+        if migrated:
+            logger.info(
+                f"Migrated attempt times for {migrated} users in {guild_id}")
@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import io
+import pstats
+import random
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime, timezone
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+from ...logger import get_logger
+from ..util.config import CONFIG
+from .metrics import wraps
+
+logger = get_logger(__name__)
+
+DIAGNOSTICS_CONFIG = CONFIG["DEFAULT"]
+
+# Recent stalls kept for !profile
+MAX_STALLS = 20
+
+
+class LoopWatchdog:
+    """Logs the event loop thread's stack when it stops running callbacks
+
+    A task on the loop records a heartbeat every interval. A separate thread
+    checks it, and once the loop has gone threshold seconds without one, it
+    captures what the loop thread is running at that moment, i.e. the
+    blocking call. Each stall is reported once.
+    """
+    def __init__(self, threshold: float, interval: float):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls: Deque[Tuple[datetime, float, str]] = deque(
+            maxlen=MAX_STALLS)
+
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.ensure_future(self._beat())
+        threading.Thread(target=self._watch,
+                         name="loop-watchdog",
+                         daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _beat(self) -> None:
+        while True:
+            self._heartbeat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stopped.wait(self.interval):
+            heartbeat = self._heartbeat
+            blocked = time.monotonic() - heartbeat
+            if blocked < self.threshold or heartbeat == reported:
+                continue
+
+            reported = heartbeat
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            self.stalls.append((datetime.now(timezone.utc), blocked, stack))
+            logger.warning(
+                f"Event loop blocked for {blocked:.3f}s, stack:\n{stack}")
+
+
+class SamplingProfiler:
+    """Profiles a random sample of calls to wrapped coroutine functions
+
+    Stats are kept per wrapped function. Only one call is profiled at a time,
+    and while it awaits, other tasks' work on the loop is counted too, so
+    reports are best read for the functions they name rather than as totals.
+    """
+    def __init__(self, sample_rate: float):
+        self.sample_rate = sample_rate
+        self.stats: Dict[str, pstats.Stats] = {}
+        self.calls: Dict[str, int] = {}
+        self._active = False
+
+    def wrap(self, name: str, func: Callable) -> Callable:
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            if self._active or random.random() >= self.sample_rate:
+                return await func(*args, **kwargs)
+
+            self._active = True
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                profile.disable()
+                self._active = False
+                self._record(name, profile)
+
+        return wrapper
+
+    def _record(self, name: str, profile: cProfile.Profile) -> None:
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if name in self.stats:
+            self.stats[name].add(profile)
+        else:
+            self.stats[name] = pstats.Stats(profile)
+
+    def instrument_cog(self, cog) -> None:
+        """Wrap a cog's listeners and commands. Call before adding the cog."""
+        cog_name = type(cog).__name__
+        for name, method in cog.get_listeners():
+            # add_cog looks listeners up on the instance, so this shadows
+            # the class's method
+            setattr(cog, method.__name__,
+                    self.wrap(f"{cog_name}.{method.__name__}", method))
+
+        for command in cog.get_commands():
+            command.callback = self.wrap(f"{cog_name}.{command.name}",
+                                         command.callback)
+
+    def report(self, limit: int) -> str:
+        out = io.StringIO()
+        for name, stats in sorted(self.stats.items()):
+            out.write(f"=== {name} ({self.calls[name]} sampled calls) ===\n")
+            stats.stream = out
+            stats.sort_stats("cumulative").print_stats(limit)
+
+        return out.getvalue()
+
+    def reset(self) -> None:
+        self.stats.clear()
+        self.calls.clear()
+
+
+watchdog: Optional[LoopWatchdog] = None
+profiler: Optional[SamplingProfiler] = None
+
+
+def start_watchdog() -> bool:
+    """Start the loop watchdog if watchdog_threshold_ms is set
+
+    Returns:
+        bool: Whether the watchdog was started
+    """
+    global watchdog
+    threshold = DIAGNOSTICS_CONFIG.getfloat("watchdog_threshold_ms",
+                                            fallback=0)
+    if not threshold:
+        return False
+
+    watchdog = LoopWatchdog(
+        threshold=threshold / 1000,
+        interval=DIAGNOSTICS_CONFIG.getfloat("watchdog_interval_ms",
+                                             fallback=50) / 1000)
+    watchdog.start()
+    logger.info(f"Watching for event loop stalls over {threshold}ms")
+
+    return True
+
+
+def get_profiler() -> Optional[SamplingProfiler]:
+    """The profiler if profile_sample_rate is set, otherwise None"""
+    global profiler
+    sample_rate = DIAGNOSTICS_CONFIG.getfloat("profile_sample_rate",
+                                              fallback=0)
+    if profiler is None and sample_rate:
+        profiler = SamplingProfiler(sample_rate)
+
+    return profiler
+
+
+def report(limit: int = 25) -> str:
+    """Recent stalls and profiles, for !profile"""
+    out = io.StringIO()
+
+    if watchdog is None:
+        out.write("Loop watchdog is off, set watchdog_threshold_ms.\n\n")
+    else:
+        out.write(f"Recent event loop stalls ({len(watchdog.stalls)}):\n")
+        for at, blocked, stack in watchdog.stalls:
+            out.write(f"--- {at.isoformat()} blocked {blocked:.3f}s ---\n")
+            out.write(f"{stack}\n")
+
+    if profiler is None:
+        out.write("Profiling is off, set profile_sample_rate.\n")
+    else:
+        out.write(profiler.report(limit))
+
+    return out.getvalue()
@@ -0,0 +1,90 @@
+from __future__ import annotations
+
+import csv
+import json
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, TextIO
+
+from . import db
+
+FORMATS = ("ndjson", "csv")
+
+CSV_FIELDS = ("user_id", "name", "discriminator", "status", "emails",
+              "verified_at", "attempts", "latest_attempt_time")
+
+
+def parse_since(since: str) -> datetime:
+    """Parse an ISO 8601 date or time, treating naive values as UTC
+
+    Raises:
+        ValueError: If since isn't ISO 8601
+    """
+    parsed = datetime.fromisoformat(since)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+
+    return parsed
+
+
+def _isoformat(value: Any) -> Any:
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.isoformat()
+
+    return value
+
+
+def to_ndjson(record: Dict[str, Any]) -> str:
+    return json.dumps(record, default=_isoformat) + "\n"
+
+
+def to_csv_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Flatten a record to one row, joining multiple emails with ;"""
+    emails = record.get("emails", [])
+    attempts = record.get("attempts", [])
+    attempt_times = [
+        a["attempt_time"] for a in attempts if "attempt_time" in a
+    ]
+
+    return {
+        "user_id": record.get("user_id"),
+        "name": record.get("name"),
+        "discriminator": record.get("discriminator"),
+        "status": record.get("status"),
+        "emails": ";".join(e["email"] for e in emails),
+        "verified_at": ";".join(
+            _isoformat(e["verified_at"]) for e in emails
+            if e.get("verified_at")),
+        "attempts": len(attempts),
+        "latest_attempt_time":
+        _isoformat(max(attempt_times)) if attempt_times else ""
+    }
+
+
+async def write_export(out: TextIO,
+                       guild_id: str,
+                       fmt: str = "ndjson",
+                       since: Optional[datetime] = None) -> int:
+    """Stream a guild's records to out, one at a time
+
+    Returns:
+        int: How many records were written
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    writer = None
+    if fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=CSV_FIELDS)
+        writer.writeheader()
+
+    count = 0
+    async for record in db.iter_guild_records(guild_id, since=since):
+        if writer is not None:
+            writer.writerow(to_csv_row(record))
+        else:
+            out.write(to_ndjson(record))
+        count += 1
+
+    return count
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import asyncio
+from typing import Dict
+
+from ...logger import get_logger
+from ..datatypes.guild_settings import GuildSettings
+from . import db
+from .broker import bus
+
+logger = get_logger(__name__)
+
+# guild_id -> settings, loaded on first use
+_settings: Dict[str, GuildSettings] = {}
+
+
+async def get_settings(guild_id: str) -> GuildSettings:
+    """Get the cached settings for a guild, loading them on a miss"""
+    settings = _settings.get(guild_id)
+    if settings is None:
+        settings = await load(guild_id)
+
+    return settings
+
+
+async def load(guild_id: str) -> GuildSettings:
+    settings = GuildSettings.from_dict(guild_id, await
+                                       db.get_guild_settings(guild_id))
+    _settings[guild_id] = settings
+
+    return settings
+
+
+def invalidate(guild_id: str) -> None:
+    _settings.pop(guild_id, None)
+
+
+async def load_all() -> None:
+    """Load every guild in the db, e.g. while the gateway connects"""
+    guild_ids = await db.get_guild_ids()
+    await asyncio.gather(*[load(guild_id) for guild_id in guild_ids])
+    logger.info(f"Loaded settings for {len(guild_ids)} guilds")
+
+
+async def refresh_all() -> None:
+    """Reload every cached guild, picking up changes made outside the bot"""
+    for guild_id in list(_settings):
+        try:
+            await load(guild_id)
+        except Exception as e:
+            logger.warning(f"Failed to refresh settings for {guild_id}: {e}")
+
+
+async def changed(guild_id: str) -> None:
+    """Drop a guild's settings here and in every other process"""
+    invalidate(guild_id)
+    await bus.publish("guild", guild_id)
+
+
+async def set_exec_role(guild_id: str, role_id: str) -> bool:
+    success = await db.set_exec_role(guild_id, role_id)
+    await changed(guild_id)
+
+    return success
+
+
+async def set_verify_channel(guild_id: str, channel_id: str) -> bool:
+    success = await db.set_verify_channel(guild_id, channel_id)
+    await changed(guild_id)
+
+    return success
+
+
+async def set_verified_role_id(guild_id: str, role_id: str) -> None:
+    await db.set_verified_role_id(guild_id, role_id)
+    await changed(guild_id)
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import inspect
+import time
+import typing
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+from prometheus_client import (Counter, Gauge, Histogram,  # type: ignore
+                               start_http_server)
+
+from ...logger import get_logger
+from ..util.config import CONFIG
+
+logger = get_logger(__name__)
+
+METRICS_CONFIG = CONFIG["DEFAULT"]
+
+# Probes and SES sends can take seconds, db ops should take milliseconds
+STAGE_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+DB_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1)
+
+STAGE_SECONDS = Histogram("verify_stage_seconds",
+                          "Time spent in each stage of verification",
+                          ["stage"],
+                          buckets=STAGE_BUCKETS)
+STAGE_TOTAL = Counter("verify_stage_total",
+                      "Verification stages run, by outcome",
+                      ["stage", "outcome"])
+DB_OP_SECONDS = Histogram("verify_db_op_seconds",
+                          "Latency of each db.py operation", ["op"],
+                          buckets=DB_BUCKETS)
+DB_OP_ERRORS = Counter("verify_db_op_errors_total",
+                       "db.py operations that raised", ["op"])
+LOOP_LAG_SECONDS = Histogram("verify_event_loop_lag_seconds",
+                             "How late the event loop ran a timed callback",
+                             buckets=DB_BUCKETS)
+RATELIMIT_DECISIONS = Counter("verify_ratelimit_decisions_total",
+                              "Rate limit checks, by rule and decision",
+                              ["rule", "decision"])
+LOOKUPS = Counter("verify_discord_lookups_total",
+                  "Guild and member lookups, by whether the gateway cache "
+                  "had them or they fell back to REST", ["kind", "source"])
+QUEUE_DEPTH = Gauge("verify_queue_depth", "Work waiting in internal queues",
+                    ["queue"])
+
+
+def wraps(func: Callable) -> Callable:
+    """functools.wraps that also resolves postponed annotations
+
+    discord.py evaluates string annotations on a command's callback against
+    the callback's own module, which for a wrapper is this one.
+    """
+    def decorator(wrapper: Callable) -> Callable:
+        wrapper = functools.wraps(func)(wrapper)
+        signature = inspect.signature(func)
+        try:
+            hints = typing.get_type_hints(func)
+        except (NameError, TypeError):
+            return wrapper
+
+        wrapper.__signature__ = signature.replace(parameters=[
+            param.replace(annotation=hints.get(name, param.annotation))
+            for name, param in signature.parameters.items()
+        ])
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time a block as a verification stage, counting errors separately"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_TOTAL.labels(name, "error").inc()
+        raise
+    else:
+        STAGE_TOTAL.labels(name, "ok").inc()
+    finally:
+        STAGE_SECONDS.labels(name).observe(time.perf_counter() - start)
+
+
+def timed_stage(name: str) -> Callable:
+    """Decorate a coroutine function to time every call as a stage"""
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with stage(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def db_op(func: Callable) -> Callable:
+    """Decorate a db coroutine function to time it, labelled by its name"""
+    histogram = DB_OP_SECONDS.labels(func.__name__)
+    errors = DB_OP_ERRORS.labels(func.__name__)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    return wrapper
+
+
+def track_queue(name: str, depth: Callable[[], float]) -> None:
+    """Report a queue's depth whenever metrics are scraped"""
+    QUEUE_DEPTH.labels(name).set_function(depth)
+
+
+async def monitor_loop_lag(interval: float) -> None:
+    """Measure how much later than asked the loop wakes a sleeping task"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        LOOP_LAG_SECONDS.observe(
+            max(0.0, time.perf_counter() - start - interval))
+
+
+def start() -> bool:
+    """Serve /metrics on a background thread if metrics_port is set
+
+    Returns:
+        bool: Whether the listener was started
+    """
+    port = METRICS_CONFIG.getint("metrics_port", fallback=0)
+    if not port:
+        return False
+
+    addr = METRICS_CONFIG.get("metrics_addr", fallback="127.0.0.1")
+    start_http_server(port, addr=addr)
+    asyncio.ensure_future(
+        monitor_loop_lag(
+            METRICS_CONFIG.getfloat("metrics_loop_lag_interval",
+                                    fallback=0.5)))
+    logger.info(f"Serving metrics on {addr}:{port}")
+
+    return True
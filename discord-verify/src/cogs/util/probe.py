@@ -0,0 +1,201 @@
+from __future__ import annotations
+
+import asyncio
+import socket
+from typing import List, Optional, Tuple
+
+import aiohttp  # type: ignore
+
+from ...logger import get_logger
+from ..util.config import CONFIG
+from . import metrics
+from .cache import TTLCache
+
+logger = get_logger(__name__)
+
+PROBE_CONFIG = CONFIG["DEFAULT"]
+
+
+class SMTPProber:
+    """Checks mailboxes with RCPT TO over one reused SMTP session
+
+    Probes are serialised on the session and separated with RSET, so a burst
+    of verifications costs one connection and EHLO rather than one each.
+    """
+    def __init__(self, host: str, port: int, timeout: float):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+        self._local_hostname = ""
+
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    async def exists(self, address: str) -> bool:
+        async with self._lock:
+            try:
+                return await self._probe(address)
+            except (OSError, asyncio.TimeoutError, ConnectionError):
+                # The server may have dropped an idle session, retry once on
+                # a fresh connection
+                await self.close()
+                return await self._probe(address)
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
+
+    async def _probe(self, address: str) -> bool:
+        if self._writer is None:
+            await self._connect()
+
+        await self._command("MAIL FROM:<>")
+        code, _ = await self._command(f"RCPT TO:<{address}>")
+        await self._command("RSET")
+
+        return code == 250
+
+    async def _connect(self) -> None:
+        if not self._local_hostname:
+            self._local_hostname = await asyncio.get_event_loop(
+            ).run_in_executor(None, socket.getfqdn)
+
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), self.timeout)
+        await self._read_reply()
+        await self._command(f"EHLO {self._local_hostname}")
+
+    async def _command(self, line: str) -> Tuple[int, List[str]]:
+        self._writer.write(f"{line}\r\n".encode())
+        await asyncio.wait_for(self._writer.drain(), self.timeout)
+
+        return await self._read_reply()
+
+    async def _read_reply(self) -> Tuple[int, List[str]]:
+        lines = []
+        while True:
+            raw = await asyncio.wait_for(self._reader.readline(),
+                                         self.timeout)
+            if not raw:
+                raise ConnectionError("SMTP connection closed")
+
+            line = raw.decode(errors="replace").rstrip("\r\n")
+            lines.append(line[4:])
+            # "250-..." continues a multiline reply, "250 ..." ends it
+            if len(line) < 4 or line[3] != "-":
+                return int(line[:3]), lines
+
+
+class SMTPProberPool:
+    """Spreads probes over up to size SMTPProber sessions
+
+    A probe takes the first idle session, so a trickle of verifications
+    keeps to one connection and only bursts, like a bulk import, open more.
+    When every session is busy, probes queue on them in turn.
+    """
+    def __init__(self, size: int, host: str, port: int, timeout: float):
+        self._probers = [
+            SMTPProber(host, port, timeout) for _ in range(max(1, size))
+        ]
+        self._next = 0
+
+    def __len__(self) -> int:
+        return len(self._probers)
+
+    async def exists(self, address: str) -> bool:
+        prober = next((p for p in self._probers if not p.busy()), None)
+        if prober is None:
+            prober = self._probers[self._next]
+            self._next = (self._next + 1) % len(self._probers)
+
+        return await prober.exists(address)
+
+    async def close(self) -> None:
+        for prober in self._probers:
+            await prober.close()
+
+
+class StaffDirectoryProber:
+    """Looks staff up in the staff search API over a reused HTTP session"""
+    def __init__(self, url: str, timeout: float):
+        self.url = url
+        self.timeout = timeout
+
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def exists(self, address: str) -> bool:
+        split = address.split("@")[0].split(".")
+        first_name = split[0]
+        last_name = split[1]
+
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+        request_json = {
+            "search_by_name": True,
+            "search_by_position": False,
+            "search_term": f"{first_name} {last_name}"
+        }
+        async with self._session.post(self.url, json=request_json) as res:
+            body = await res.json(content_type=None)
+
+        emails = [member["email_address"] for member in body["staff"]]
+
+        return address in emails
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+
+
+smtp_prober = SMTPProberPool(
+    size=PROBE_CONFIG.getint("smtp_probe_sessions", fallback=4),
+    host=PROBE_CONFIG["student_mail_server"],
+    port=PROBE_CONFIG.getint("student_mail_port", fallback=25),
+    timeout=PROBE_CONFIG.getfloat("smtp_probe_timeout", fallback=10))
+staff_prober = StaffDirectoryProber(
+    url=PROBE_CONFIG["staff_search_url"],
+    timeout=PROBE_CONFIG.getfloat("staff_probe_timeout", fallback=10))
+
+# address -> whether it exists
+results: TTLCache[bool] = TTLCache()
+positive_ttl = PROBE_CONFIG.getfloat("probe_cache_ttl_seconds",
+                                     fallback=86400)
+negative_ttl = PROBE_CONFIG.getfloat("probe_negative_cache_ttl_seconds",
+                                     fallback=600)
+
+
+async def address_exists(address: str) -> bool:
+    """Check a validated address against the student mail server or the
+    staff directory. Errors are raised and not cached.
+    """
+    cached = results.get(address)
+    if cached is not None:
+        return cached
+
+    student = address.split("@")[1] == PROBE_CONFIG["student_domain"]
+    if student:
+        # AWS blocks outbound port 25 and requires a request to open it up
+        if PROBE_CONFIG.getboolean("aws_instance", fallback=False):
+            return True
+        with metrics.stage("smtp_probe"):
+            exists = await smtp_prober.exists(address)
+    else:
+        with metrics.stage("staff_probe"):
+            exists = await staff_prober.exists(address)
+
+    results.set(address, exists, positive_ttl if exists else negative_ttl)
+
+    return exists
+
+
+async def close() -> None:
+    await smtp_prober.close()
+    await staff_prober.close()
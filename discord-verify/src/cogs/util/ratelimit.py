@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError  # type: ignore
+
+from ...logger import get_logger
+from ..util.config import CONFIG
+from . import db, metrics
+
+logger = get_logger(__name__)
+
+
+class Rule:
+    name: str
+    limit: int
+    window: float
+
+    def __init__(self, name: str, limit: int, window: float):
+        self.name = name
+        self.limit = limit
+        self.window = window
+
+    def describe_window(self) -> str:
+        """The window in words for replies, e.g. 24 hours"""
+        for unit, seconds in (("hour", 3600), ("minute", 60)):
+            if self.window >= seconds and self.window % seconds == 0:
+                count = int(self.window // seconds)
+                return f"{count} {unit}{'s' if count != 1 else ''}"
+
+        return f"{self.window:g} seconds"
+
+    @staticmethod
+    def parse(name: str, spec: str) -> Rule:
+        """Parse a "<limit>/<window seconds>" config value"""
+        limit, window = spec.split("/")
+        return Rule(name, int(limit), float(window))
+
+
+class MemoryStore:
+    """Sliding log per key, holding at most `limit` timestamps. Expired
+    entries are dropped from the front, so decisions are amortised O(1).
+    Keys that go idle are swept every SWEEP_SECONDS so the store doesn't
+    grow without bound.
+    """
+    SWEEP_SECONDS = 60
+
+    def __init__(self):
+        # key -> (window, log)
+        self._logs: Dict[str, Tuple[float, Deque[float]]] = {}
+        self._last_sweep = time.time()
+
+    def _prune(self, key: str, rule: Rule, now: float) -> Deque[float]:
+        entry = self._logs.get(key)
+        if entry is None:
+            return deque(maxlen=rule.limit)
+
+        log = entry[1]
+        cutoff = now - rule.window
+        while log and log[0] <= cutoff:
+            log.popleft()
+
+        return log
+
+    def _sweep(self, now: float) -> None:
+        if now - self._last_sweep < self.SWEEP_SECONDS:
+            return
+
+        self._last_sweep = now
+        idle = [
+            key for key, (window, log) in self._logs.items()
+            if not log or log[-1] <= now - window
+        ]
+        for key in idle:
+            del self._logs[key]
+
+    def __len__(self) -> int:
+        return len(self._logs)
+
+    async def count(self, key: str, rule: Rule) -> int:
+        return len(self._prune(key, rule, time.time()))
+
+    async def hit(self, key: str, rule: Rule) -> bool:
+        now = time.time()
+        self._sweep(now)
+        log = self._prune(key, rule, now)
+        if len(log) >= rule.limit:
+            return False
+
+        log.append(now)
+        self._logs[key] = (rule.window, log)
+        return True
+
+    async def undo(self, key: str, rule: Rule) -> None:
+        """Take back the latest hit"""
+        entry = self._logs.get(key)
+        if entry is not None and entry[1]:
+            entry[1].pop()
+
+
+class MongoStore:
+    """Sliding log per key kept in one document, shared between processes
+
+    The document keeps the last `limit` hits. A hit is allowed when there are
+    fewer than `limit` of them or the oldest has left the window, which the
+    update filter checks atomically.
+    """
+    async def count(self, key: str, rule: Rule) -> int:
+        doc = await db.get_rate_limits_collection().find_one({"_id": key})
+        if not doc:
+            return 0
+
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=rule.window)
+        return sum(1 for hit in doc["hits"] if hit > cutoff)
+
+    async def hit(self, key: str, rule: Rule) -> bool:
+        now = datetime.now(timezone.utc)
+        cutoff = now - timedelta(seconds=rule.window)
+        try:
+            await db.get_rate_limits_collection().update_one(
+                {
+                    "_id":
+                    key,
+                    "$or": [{
+                        f"hits.{rule.limit - 1}": {
+                            "$exists": False
+                        }
+                    }, {
+                        "hits.0": {
+                            "$lte": cutoff
+                        }
+                    }]
+                }, {
+                    "$push": {
+                        "hits": {
+                            "$each": [now],
+                            "$slice": -rule.limit
+                        }
+                    },
+                    "$set": {
+                        "expires_at": now + timedelta(seconds=rule.window)
+                    }
+                },
+                upsert=True)
+        except DuplicateKeyError:
+            # The document exists but the filter didn't match, so the window
+            # is full
+            return False
+
+        return True
+
+    async def undo(self, key: str, rule: Rule) -> None:
+        """Take back the latest hit"""
+        await db.get_rate_limits_collection().update_one(
+            {"_id": key}, {"$pop": {
+                "hits": 1
+            }})
+
+
+class RateLimiter:
+    """Throttles verification work per user, guild, email domain and globally
+
+    Each rule has its own store. Keys are namespaced by rule name, so one
+    store can back several rules.
+    """
+    def __init__(self, rules: List[Rule], stores: Dict[str, Any]):
+        self.rules = {rule.name: rule for rule in rules}
+        self.stores = stores
+
+    async def count(self, rule_name: str, key: str) -> int:
+        rule = self.rules[rule_name]
+        return await self.stores[rule_name].count(f"{rule_name}:{key}", rule)
+
+    def _denied(self, rule_name: str, key: str) -> None:
+        metrics.RATELIMIT_DECISIONS.labels(rule_name, "denied").inc()
+        logger.info(f"Rate limited by {rule_name}: {key}")
+
+    async def hit(self, rule_name: str, key: str) -> bool:
+        """Record a hit against a single rule
+
+        Returns:
+            bool: False if the rule's limit has been reached
+        """
+        rule = self.rules[rule_name]
+        allowed = await self.stores[rule_name].hit(f"{rule_name}:{key}",
+                                                   rule)
+
+        if allowed:
+            metrics.RATELIMIT_DECISIONS.labels(rule_name, "allowed").inc()
+        else:
+            self._denied(rule_name, key)
+
+        return allowed
+
+    async def acquire(self, checks: List[Tuple[str, str]]) -> Optional[str]:
+        """Record a hit against several rules, only if none is at its limit
+
+        The limits are checked first, but another task can take the last hit
+        in between. If a hit is then denied, the hits already recorded for the
+        earlier rules are taken back.
+
+        Args:
+            checks (List[Tuple[str, str]]): (rule name, key) pairs
+
+        Returns:
+            Optional[str]: The name of the rule that denied, or None
+        """
+        for rule_name, key in checks:
+            if await self.count(rule_name, key) >= self.rules[rule_name].limit:
+                self._denied(rule_name, key)
+                return rule_name
+
+        taken: List[Tuple[str, str]] = []
+        for rule_name, key in checks:
+            if not await self.hit(rule_name, key):
+                for taken_rule, taken_key in taken:
+                    await self.stores[taken_rule].undo(
+                        f"{taken_rule}:{taken_key}", self.rules[taken_rule])
+                return rule_name
+
+            taken.append((rule_name, key))
+
+        return None
+
+
+def _from_config() -> RateLimiter:
+    config = CONFIG["DEFAULT"]
+    defaults = {
+        "user": "3/86400",
+        "guild": "200/3600",
+        "domain": "300/3600",
+        "global": "500/3600"
+    }
+    rules = [
+        Rule.parse(name, config.get(f"ratelimit_{name}", fallback=spec))
+        for name, spec in defaults.items()
+    ]
+
+    # The user rule spans a day, so it outlives restarts by default
+    default_store = config.get("ratelimit_store", fallback="memory")
+    store_defaults = {"user": "mongo"}
+    memory_store = MemoryStore()
+    mongo_store = MongoStore()
+    stores = {}
+    for rule in rules:
+        kind = config.get(f"ratelimit_{rule.name}_store",
+                          fallback=store_defaults.get(rule.name,
+                                                      default_store))
+        stores[rule.name] = mongo_store if kind == "mongo" else memory_store
+
+    return RateLimiter(rules, stores)
+
+
+limiter = _from_config()
@@ -0,0 +1,148 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+from discord import DMChannel, Member, Message, Role, User  # type: ignore
+
+from ...logger import get_logger
+from ..util.config import CONFIG
+from .cache import TTLCache
+
+logger = get_logger(__name__)
+
+REST_CONFIG = CONFIG["DEFAULT"]
+
+# Routes the scheduler paces separately
+ROUTES = ("create_dm", "send_message", "delete_message", "edit_member")
+
+# DM channels don't change, keep them for a day
+DM_CHANNEL_TTL = 86400
+
+
+class Bucket:
+    """Spaces calls evenly so no more than `rate` start per second"""
+    def __init__(self, rate: float):
+        self._interval = 1 / rate
+        self._next_call = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_call - now
+            if wait > 0:
+                await asyncio.sleep(wait)
+                now += wait
+            self._next_call = now + self._interval
+
+
+class PendingRoles:
+    member: Member
+    roles: List[Role]
+    reason: Optional[str]
+    futures: List[asyncio.Future]
+
+    def __init__(self, member: Member, reason: Optional[str]):
+        self.member = member
+        self.roles = []
+        self.reason = reason
+        self.futures = []
+
+
+class RestScheduler:
+    """Paces the bot's own Discord REST calls ahead of discord.py's reactive
+    429 handling
+
+    DM channels are cached. Role grants queued for the same member within
+    role_flush_seconds are merged into one member edit. Every call goes
+    through its route's bucket and a global bucket. The scheduler only calls
+    methods on the discord objects it is given, so it can be tested with
+    mocks.
+    """
+    def __init__(self, global_rate: float, route_rate: float,
+                 role_flush_seconds: float):
+        self.role_flush_seconds = role_flush_seconds
+
+        self._global = Bucket(global_rate)
+        self._routes = {route: Bucket(route_rate) for route in ROUTES}
+        self._dm_channels: TTLCache[DMChannel] = TTLCache()
+        self._pending_roles: Dict[Tuple[int, int], PendingRoles] = {}
+
+    async def _pace(self, route: str) -> None:
+        await self._routes[route].acquire()
+        await self._global.acquire()
+
+    async def get_dm(self, user: User) -> DMChannel:
+        channel = user.dm_channel or self._dm_channels.get(user.id)
+        if channel is None:
+            await self._pace("create_dm")
+            channel = await user.create_dm()
+
+        self._dm_channels.set(user.id, channel, DM_CHANNEL_TTL)
+        return channel
+
+    async def send_dm(self, user: User, content: str) -> Message:
+        channel = await self.get_dm(user)
+        await self._pace("send_message")
+
+        return await channel.send(content)
+
+    async def delete(self, message: Message) -> None:
+        await self._pace("delete_message")
+        await message.delete()
+
+    async def add_roles(self,
+                        member: Member,
+                        *roles: Role,
+                        reason: Optional[str] = None) -> None:
+        """Queue roles for a member, resolving once the merged edit is made
+
+        Raises:
+            discord.HTTPException: If the merged edit fails
+        """
+        key = (member.guild.id, member.id)
+        pending = self._pending_roles.get(key)
+        if pending is None:
+            pending = self._pending_roles[key] = PendingRoles(member, reason)
+            asyncio.get_event_loop().call_later(
+                self.role_flush_seconds,
+                lambda: asyncio.ensure_future(self._flush_roles(key)))
+
+        pending.roles.extend(role for role in roles
+                             if role not in pending.roles)
+        future = asyncio.get_event_loop().create_future()
+        pending.futures.append(future)
+
+        await future
+
+    async def _flush_roles(self, key: Tuple[int, int]) -> None:
+        pending = self._pending_roles.pop(key)
+        try:
+            await self._pace("edit_member")
+            # A single role is added on its own so a concurrent change to
+            # the member's other roles can't be overwritten. Several are
+            # merged into one edit with the member's full role list.
+            await pending.member.add_roles(
+                *pending.roles,
+                reason=pending.reason,
+                atomic=len(pending.roles) == 1)
+        except Exception as e:
+            for future in pending.futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future in pending.futures:
+                if not future.done():
+                    future.set_result(None)
+
+    def pending_role_edits(self) -> int:
+        return len(self._pending_roles)
+
+
+scheduler = RestScheduler(
+    global_rate=REST_CONFIG.getfloat("rest_global_rate", fallback=40),
+    route_rate=REST_CONFIG.getfloat("rest_route_rate", fallback=5),
+    role_flush_seconds=REST_CONFIG.getfloat("rest_role_flush_seconds",
+                                            fallback=0.5))
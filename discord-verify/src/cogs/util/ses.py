@@ -1,6 +1,12 @@
 from __future__ import annotations
 
-import boto3  # type: ignore
+import asyncio
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Sequence, Tuple
 
 from ...logger import get_logger
 from ..datatypes.email_address import Email
@@ -8,10 +14,403 @@ from ..util.config import CONFIG
 
 logger = get_logger(__name__)
 
-client = boto3.client("ses")
+SES_CONFIG = CONFIG["DEFAULT"]
 
+# SES error codes worth retrying, everything else fails the send immediately
+RETRYABLE_ERROR_CODES = {
+    "Throttling", "ThrottlingException", "ServiceUnavailable",
+    "InternalFailure", "RequestTimeout"
+}
 
-def send_email(verification_code: str, email: Email) -> bool:
+# SES caps SendBulkTemplatedEmail at 50 destinations
+MAX_BATCH_SIZE = 50
+
+workers = SES_CONFIG.getint("ses_workers", fallback=4)
+template_name = SES_CONFIG.get("ses_template_name",
+                               fallback="MACSVerificationCode")
+
+# Made on first use, boto3 is slow to import and build a client with, so
+# boto3 and botocore are only imported where they are needed
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """The shared SES client. Safe to call from the dispatcher's threads."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            import boto3  # type: ignore
+            from botocore.config import Config  # type: ignore
+
+            # One pooled connection per worker thread. Retries are handled by
+            # the dispatcher so botocore's own are turned off.
+            _client = boto3.client(
+                "ses",
+                endpoint_url=SES_CONFIG.get("ses_endpoint_url") or None,
+                config=Config(max_pool_connections=workers,
+                              retries={"max_attempts": 0}))
+
+    return _client
+
+
+async def warm_up() -> None:
+    """Build the client, and register the template if sending in batches,
+    before the first send
+    """
+    await asyncio.get_event_loop().run_in_executor(None, get_client)
+    if dispatcher.batch_size > 1:
+        await dispatcher.ensure_template()
+
+
+SUBJECT = "Your MACS Verification Code"
+BODY = ("Here is your verification code for the MACS "
+        "Discord server:\n\n{verification_code}\n\nIf you "
+        "did not request this code, please ignore this email.")
+
+
+def build_message(verification_code: str) -> dict:
+    return {
+        "Subject": {
+            "Data": SUBJECT,
+        },
+        "Body": {
+            "Text": {
+                "Data": BODY.format(verification_code=verification_code),
+            }
+        }
+    }
+
+
+def build_template() -> dict:
+    """The message from build_message as an SES template for bulk sends"""
+    return {
+        "TemplateName":
+        template_name,
+        "SubjectPart":
+        SUBJECT,
+        "TextPart":
+        BODY.format(verification_code="{{verification_code}}"),
+    }
+
+
+class SendRateLimiter:
+    """Spaces sends so they stay under the SES per-second sending quota"""
+    def __init__(self, max_per_second: float):
+        self._interval = 1 / max_per_second
+        self._next_send = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, recipients: int = 1) -> None:
+        """Wait until `recipients` more emails can be sent"""
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_send - now
+            if wait > 0:
+                await asyncio.sleep(wait)
+                now += wait
+            self._next_send = now + self._interval * recipients
+
+
+class MailDispatcher:
+    """Sends verification emails from a bounded queue with a pool of workers
+
+    Each worker runs the blocking boto3 call in a thread so the event loop is
+    never held up by SES. Callers await the result of their own send.
+
+    With batch_size > 1, workers instead collect up to batch_size queued
+    emails, waiting at most flush_seconds, and send them in one
+    SendBulkTemplatedEmail call. Batches are capped at max_send_rate.
+    """
+    def __init__(self,
+                 workers: int,
+                 queue_size: int,
+                 max_send_rate: float,
+                 max_retries: int,
+                 batch_size: int = 1,
+                 flush_seconds: float = 1):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.max_send_rate = max_send_rate
+        self.max_retries = max_retries
+        # The rate limiter spaces sends out after each call, so a batch
+        # larger than the per-second quota would burst past it
+        self.batch_size = max(
+            1, min(batch_size, MAX_BATCH_SIZE, int(max_send_rate)))
+        self.flush_seconds = flush_seconds
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix="ses")
+        self._rate_limiter: Optional[SendRateLimiter] = None
+        self._template_ready = False
+        self._template_lock: Optional[asyncio.Lock] = None
+
+    def start(self) -> None:
+        if self._queue is not None:
+            return
+
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._rate_limiter = SendRateLimiter(self.max_send_rate)
+        worker = self._batch_worker if self.batch_size > 1 else self._worker
+        self._tasks = [
+            asyncio.ensure_future(worker()) for _ in range(self.workers)
+        ]
+
+    async def stop(self, timeout: float = 10) -> None:
+        """Send what is already queued, waiting up to timeout seconds, then
+        stop the workers and their threads. Emails still unsent after that
+        resolve as failed.
+        """
+        if self._queue is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"{self._queue.qsize()} queued emails were "
+                               "not sent before shutdown")
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+        while self._queue is not None and not self._queue.empty():
+            _, _, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_result(False)
+
+        self._tasks = []
+        self._queue = None
+        self._executor.shutdown(wait=False)
+        # Threads are only started on use, so a restart gets a fresh pool
+        self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                            thread_name_prefix="ses")
+
+    async def ensure_template(self) -> None:
+        """Register the bulk send template once, however many workers need it
+        at the same time
+        """
+        if self._template_lock is None:
+            self._template_lock = asyncio.Lock()
+
+        async with self._template_lock:
+            if not self._template_ready:
+                await asyncio.get_event_loop().run_in_executor(
+                    self._executor, _ensure_template)
+                self._template_ready = True
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def send(self, verification_code: str, email: Email) -> bool:
+        """Queue a verification email and wait for it to be sent
+
+        Returns:
+            bool: True if SES accepted the email
+        """
+        self.start()
+
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((verification_code, email, future))
+
+        return await future
+
+    async def _worker(self) -> None:
+        while True:
+            verification_code, email, future = await self._queue.get()
+            try:
+                success = await self._send_with_retries(
+                    verification_code, email)
+            except asyncio.CancelledError:
+                if not future.done():
+                    future.set_result(False)
+                raise
+            except Exception as e:
+                logger.error(f"Unexpected error sending to {email.address}: "
+                             f"{e}")
+                success = False
+
+            if not future.done():
+                future.set_result(success)
+            self._queue.task_done()
+
+    async def _batch_worker(self) -> None:
+        loop = asyncio.get_event_loop()
+
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(
+                        self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                results = await self._send_batch_with_retries(
+                    [(code, email) for code, email, _ in batch])
+            except asyncio.CancelledError:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_result(False)
+                raise
+            except Exception as e:
+                logger.error(f"Unexpected error sending batch: {e}")
+                results = [False] * len(batch)
+
+            for (_, _, future), success in zip(batch, results):
+                if not future.done():
+                    future.set_result(success)
+                self._queue.task_done()
+
+    async def _send_batch_with_retries(
+            self, batch: Sequence[Tuple[str, Email]]) -> List[bool]:
+        loop = asyncio.get_event_loop()
+
+        await self.ensure_template()
+
+        for attempt in range(self.max_retries + 1):
+            await self._rate_limiter.acquire(len(batch))
+
+            retryable, error, statuses = await loop.run_in_executor(
+                self._executor, _send_bulk, batch)
+            if error is None:
+                for (_, email), status in zip(batch, statuses):
+                    if status["Status"] != "Success":
+                        logger.info(
+                            f"Sending to {email.address} failed: "
+                            f"{status['Status']} {status.get('Error')}")
+
+                return [status["Status"] == "Success" for status in statuses]
+
+            logger.info(f"Sending batch of {len(batch)} failed: {error}")
+            if not retryable or attempt == self.max_retries:
+                break
+
+            await asyncio.sleep((2**attempt) * 0.5 + random.random() * 0.5)
+
+        return [False] * len(batch)
+
+    async def _send_with_retries(self, verification_code: str,
+                                 email: Email) -> bool:
+        loop = asyncio.get_event_loop()
+
+        for attempt in range(self.max_retries + 1):
+            await self._rate_limiter.acquire()
+
+            retryable, error = await loop.run_in_executor(
+                self._executor, _send_one, verification_code, email)
+            if error is None:
+                return True
+
+            logger.info(f"Sending to {email.address} failed: {error}")
+            if not retryable or attempt == self.max_retries:
+                break
+
+            # Exponential backoff with jitter
+            await asyncio.sleep((2**attempt) * 0.5 + random.random() * 0.5)
+
+        return False
+
+
+def _send_one(verification_code: str,
+              email: Email) -> Tuple[bool, Optional[Exception]]:
+    """Blocking send, run on a dispatcher thread
+
+    Returns:
+        Tuple[bool, Optional[Exception]]: (retryable, error), error is None on
+        success
+    """
+    from botocore.exceptions import (BotoCoreError,  # type: ignore
+                                     ClientError, EndpointConnectionError)
+
+    try:
+        get_client().send_email(Source=CONFIG["DEFAULT"]["sender_address"],
+                                Destination={"ToAddresses": [
+                                    f"{email.address}",
+                                ]},
+                                Message=build_message(verification_code))
+        return False, None
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code", "")
+        return code in RETRYABLE_ERROR_CODES, e
+    except EndpointConnectionError as e:
+        return True, e
+    except BotoCoreError as e:
+        return False, e
+
+
+def _send_bulk(
+    batch: Sequence[Tuple[str, Email]]
+) -> Tuple[bool, Optional[Exception], List[dict]]:
+    """Blocking bulk templated send, run on a dispatcher thread
+
+    Returns:
+        Tuple[bool, Optional[Exception], List[dict]]: (retryable, error,
+        per destination statuses in batch order)
+    """
+    destinations = [{
+        "Destination": {
+            "ToAddresses": [email.address]
+        },
+        "ReplacementTemplateData":
+        json.dumps({"verification_code": verification_code})
+    } for verification_code, email in batch]
+
+    from botocore.exceptions import (BotoCoreError,  # type: ignore
+                                     ClientError, EndpointConnectionError)
+
+    try:
+        res = get_client().send_bulk_templated_email(
+            Source=CONFIG["DEFAULT"]["sender_address"],
+            Template=template_name,
+            DefaultTemplateData=json.dumps({"verification_code": ""}),
+            Destinations=destinations)
+        return False, None, res["Status"]
+    except ClientError as e:
+        code = e.response.get("Error", {}).get("Code", "")
+        return code in RETRYABLE_ERROR_CODES, e, []
+    except EndpointConnectionError as e:
+        return True, e, []
+    except BotoCoreError as e:
+        return False, e, []
+
+
+def _ensure_template() -> None:
+    """Register the verification template, updating it if it already exists"""
+    from botocore.exceptions import ClientError  # type: ignore
+
+    template = build_template()
+    try:
+        get_client().update_template(Template=template)
+        return
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") != "TemplateDoesNotExist":
+            raise
+
+    try:
+        get_client().create_template(Template=template)
+    except ClientError as e:
+        # Another process created it first
+        if e.response.get("Error", {}).get("Code") != "AlreadyExists":
+            raise
+
+
+dispatcher = MailDispatcher(
+    workers=workers,
+    queue_size=SES_CONFIG.getint("ses_queue_size", fallback=500),
+    max_send_rate=SES_CONFIG.getfloat("ses_max_send_rate", fallback=14),
+    max_retries=SES_CONFIG.getint("ses_max_retries", fallback=3),
+    batch_size=SES_CONFIG.getint("ses_batch_size", fallback=50)
+    if SES_CONFIG.getboolean("ses_batch_enabled", fallback=False) else 1,
+    flush_seconds=SES_CONFIG.getfloat("ses_batch_flush_seconds", fallback=1))
+
+
+async def send_email(verification_code: str, email: Email) -> bool:
 
     logger.info(f"""
     To: {email.address}
@@ -19,27 +418,4 @@ def send_email(verification_code: str, email: Email) -> bool:
     {verification_code}
     """)
 
-    try:
-        client.send_email(
-            Source=CONFIG["DEFAULT"]["sender_address"],
-            Destination={"ToAddresses": [
-                f"{email.address}",
-            ]},
-            Message={
-                "Subject": {
-                    "Data": "Your MACS Verification Code",
-                },
-                "Body": {
-                    "Text": {
-                        "Data":
-                        "Here is your verification code for the MACS "
-                        f"Discord server:\n\n{verification_code}\n\nIf you "
-                        "did not request this code, please ignore this email.",
-                    }
-                }
-            })
-
-        return True
-    except Exception as e:
-        logger.info(e)
-        return False
+    return await dispatcher.send(verification_code, email)
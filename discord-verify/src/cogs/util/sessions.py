@@ -0,0 +1,308 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from ...logger import get_logger
+from ..datatypes.user import User
+from ..util.config import CONFIG
+from . import db
+from .broker import bus
+
+logger = get_logger(__name__)
+
+SESSION_CONFIG = CONFIG["DEFAULT"]
+
+
+class Session:
+    """A user part way through verifying for one guild
+
+    stored holds the statuses of the user's attempts as the db has them, so
+    a flush only writes what changed since. Sessions of the same user object
+    share the list.
+    """
+    __slots__ = ("user", "guild_id", "started_at", "stored")
+
+    user: User
+    guild_id: str
+    started_at: float
+    stored: List[str]
+
+    def __init__(self,
+                 user: User,
+                 guild_id: str,
+                 started_at: float = 0,
+                 stored: Optional[List[str]] = None):
+        self.user = user
+        self.guild_id = guild_id
+        self.started_at = started_at or time.time()
+        self.stored = stored if stored is not None else [
+            attempt.status for attempt in user.attempts
+        ]
+
+
+class SessionStore:
+    """In-memory verification sessions keyed by user id
+
+    Sessions hold the waiting -> has code -> verified/failed state, so a DM
+    needs no db reads. Changes are written behind: users marked dirty are
+    saved, and waiting entries added or removed, in bulk every
+    flush_seconds, as the status and any new attempts rather than the whole
+    document. On startup the store is rebuilt from waiting_for_verify.
+
+    When several processes share the db, the store is `shared`: changes are
+    flushed straight away and announced on the broker so other processes drop
+    their copy, and sessions another process started are loaded on demand.
+    DMs only reach shard 0, so that is where most of them are handled.
+    """
+    def __init__(self, flush_seconds: float, ttl_seconds: float):
+        self.flush_seconds = flush_seconds
+        self.ttl_seconds = ttl_seconds
+        self.ready = asyncio.Event()
+        self.shared = False
+
+        self._sessions: Dict[str, Session] = {}
+        # (user_id, guild_id) -> session whose user to save
+        self._dirty_users: Dict[Tuple[str, str], Session] = {}
+        # Sessions being written by the flush in progress
+        self._flushing_users: Dict[Tuple[str, str], Session] = {}
+        self._waiting_added: Dict[str, Tuple[User, str]] = {}
+        self._waiting_removed: Set[str] = set()
+        # Users whose session changed since the last flush
+        self._changed: Set[str] = set()
+        self._flush_soon: Optional[asyncio.Future] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def pending_writes(self) -> int:
+        """Users and waiting entries queued for the next flush"""
+        return (len(self._dirty_users) + len(self._waiting_added) +
+                len(self._waiting_removed))
+
+    def get(self, user_id: str) -> Optional[Session]:
+        session = self._sessions.get(user_id)
+        if session and time.time() - session.started_at > self.ttl_seconds:
+            # Mirrors the TTL on waiting_for_verify
+            del self._sessions[user_id]
+            return None
+
+        return session
+
+    def pending_user(self, user_id: str, guild_id: str) -> Optional[User]:
+        """A user saved since the last flush finished, which the db may not
+        have yet
+        """
+        key = (user_id, guild_id)
+        session = self._dirty_users.get(key) or self._flushing_users.get(key)
+
+        return session.user if session else None
+
+    def expire(self) -> int:
+        """Drop sessions past the TTL that nothing has looked up since
+
+        Returns:
+            int: The number of sessions dropped
+        """
+        cutoff = time.time() - self.ttl_seconds
+        expired = [
+            user_id for user_id, session in self._sessions.items()
+            if session.started_at < cutoff
+        ]
+        for user_id in expired:
+            del self._sessions[user_id]
+
+        return len(expired)
+
+    async def fetch(self, user_id: str) -> Optional[Session]:
+        """Get a session, loading it from the db if another process may own
+        it
+        """
+        session = self.get(user_id)
+        if session is not None or not self.shared:
+            return session
+
+        waiting_user = await db.get_waiting_user_details(user_id)
+        if not waiting_user:
+            return None
+
+        user = await db.get_user(user_id, waiting_user["guild_id"])
+        if user is None or user.status not in ("waiting", "has code"):
+            return None
+
+        created_at = waiting_user.get("created_at")
+        session = Session(user, waiting_user["guild_id"],
+                          created_at.timestamp() if created_at else 0)
+
+        return self._sessions.setdefault(user_id, session)
+
+    def forget(self, user_id: str) -> None:
+        """Drop the local copy of a session another process changed"""
+        self._sessions.pop(user_id, None)
+
+    def _mark_changed(self, user_id: str) -> None:
+        self._changed.add(user_id)
+        if self.shared and self._flush_soon is None:
+            self._flush_soon = asyncio.ensure_future(self._flush_now())
+
+    async def _flush_now(self) -> None:
+        # Changes made from here on schedule another flush
+        self._flush_soon = None
+        await self.flush()
+
+    def begin(self, user: User, guild_id: str) -> Session:
+        """Start or restart a user's session for a guild"""
+        session = Session(user, guild_id, stored=self._stored(user, guild_id))
+        self._sessions[user.user_id] = session
+
+        self.save(session)
+        self._waiting_removed.discard(user.user_id)
+        self._waiting_added[user.user_id] = (user, guild_id)
+
+        return session
+
+    def _stored(self, user: User, guild_id: str) -> Optional[List[str]]:
+        """The stored attempts of an earlier session of this user object,
+        whose changes may not all be written yet
+        """
+        key = (user.user_id, guild_id)
+        for session in (self._dirty_users.get(key),
+                        self._flushing_users.get(key),
+                        self._sessions.get(user.user_id)):
+            if (session is not None and session.user is user
+                    and session.guild_id == guild_id):
+                return session.stored
+
+        return None
+
+    def save(self, session: Session) -> None:
+        """Mark the session's user to be written on the next flush"""
+        user = session.user
+        self._dirty_users[(user.user_id, session.guild_id)] = session
+        self._mark_changed(user.user_id)
+
+    def finish(self, user_id: str) -> None:
+        """End a user's session, saving its final state"""
+        session = self._sessions.pop(user_id, None)
+        if session is not None:
+            self.save(session)
+
+        self._waiting_added.pop(user_id, None)
+        self._waiting_removed.add(user_id)
+        self._mark_changed(user_id)
+
+    def discard(self, user_id: str) -> None:
+        """Drop a session without writing anything, e.g. after deleteme"""
+        self._sessions.pop(user_id, None)
+        self._waiting_added.pop(user_id, None)
+        for key in [key for key in self._dirty_users if key[0] == user_id]:
+            del self._dirty_users[key]
+        self._mark_changed(user_id)
+
+    async def flush(self) -> None:
+        async with self._flush_lock:
+            dirty_users, self._dirty_users = self._dirty_users, {}
+            self._flushing_users = dirty_users
+            waiting_added, self._waiting_added = self._waiting_added, {}
+            waiting_removed = self._waiting_removed
+            self._waiting_removed = set()
+            changed, self._changed = self._changed, set()
+
+            by_guild: Dict[str, List[Session]] = defaultdict(list)
+            for (_, guild_id), session in dirty_users.items():
+                by_guild[guild_id].append(session)
+
+            try:
+                for guild_id, guild_sessions in by_guild.items():
+                    await self._write(guild_sessions, guild_id, dirty_users)
+                await db.update_waiting(add=list(waiting_added.values()),
+                                        remove=list(waiting_removed))
+            except Exception as e:
+                self._flushing_users = {}
+                logger.error(f"Failed to flush sessions, will retry: {e}")
+                # Requeue anything that wasn't superseded in the meantime
+                for key, session in dirty_users.items():
+                    self._dirty_users.setdefault(key, session)
+                for user_id, entry in waiting_added.items():
+                    if user_id not in self._waiting_removed:
+                        self._waiting_added.setdefault(user_id, entry)
+                for user_id in waiting_removed:
+                    if user_id not in self._waiting_added:
+                        self._waiting_removed.add(user_id)
+                self._changed.update(changed)
+                return
+
+            self._flushing_users = {}
+
+            # Only announce once the db has the new state
+            for user_id in changed:
+                await bus.publish("session", user_id)
+
+    @staticmethod
+    async def _write(guild_sessions: List[Session], guild_id: str,
+                     dirty_users: Dict[Tuple[str, str], Session]) -> None:
+        """Write one guild's changed users, then drop them from dirty_users
+        so a later failure doesn't write them again
+        """
+        requests = []
+        written = []
+        for session in guild_sessions:
+            user = session.user
+            requests.extend(db.user_updates(user, session.stored))
+            written.append([attempt.status for attempt in user.attempts])
+
+        await db.save_user_updates(requests, guild_id)
+
+        for session, stored in zip(guild_sessions, written):
+            session.stored[:] = stored
+            del dirty_users[(session.user.user_id, guild_id)]
+
+    async def rehydrate(self) -> None:
+        """Rebuild sessions from the users still waiting in the db
+
+        The store is marked ready even if this fails, so DMs are handled, and
+        fail visibly, rather than waiting forever.
+        """
+        try:
+            async for waiting_user, user in db.get_waiting_users():
+                if user is None or user.status not in ("waiting", "has code"):
+                    continue
+
+                created_at = waiting_user.get("created_at")
+                started_at = created_at.timestamp() if created_at else 0
+                # Sessions begun while restoring are newer, keep those
+                self._sessions.setdefault(
+                    user.user_id,
+                    Session(user, waiting_user["guild_id"], started_at))
+
+            logger.info(
+                f"Restored {len(self._sessions)} verification sessions")
+        finally:
+            self.ready.set()
+
+    def start(self) -> None:
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_loop())
+
+    async def stop(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            self.expire()
+            await self.flush()
+
+
+store = SessionStore(
+    flush_seconds=SESSION_CONFIG.getfloat("session_flush_seconds",
+                                          fallback=2),
+    ttl_seconds=SESSION_CONFIG.getfloat("waiting_ttl_hours", fallback=24) *
+    3600)
@@ -1,8 +1,6 @@
 from __future__ import annotations
 
-import datetime
 import uuid
-from typing import List
 
 from discord import Guild, Member, Message  # type: ignore
 from discord.ext import commands  # type: ignore
@@ -12,52 +10,60 @@ from ...logger import get_logger
 from ..datatypes.attempt import Attempt
 from ..datatypes.email_address import Email
 from ..datatypes.user import User
-from . import db
+from . import db, guild_cache, metrics, ratelimit, rest
 
 logger = get_logger(__name__)
 
 
-async def add_verified_role(guilds: List[Guild], user_id: str,
+@metrics.timed_stage("add_verified_role")
+async def add_verified_role(bot: commands.Bot, user_id: str,
                             guild_id: str) -> None:
     # DEBUG
     # return
 
-    guild = get_guild_from_id(guilds, guild_id)
+    guild = await get_guild_from_id(bot, guild_id)
     member = await get_member_from_user_id(user_id=user_id, guild=guild)
-    verified = is_verified_in_guild(member=member, guild=guild)
+    verified = await is_verified_in_guild(member=member, guild=guild)
     if verified:
         return
 
-    verified_role_id = db.get_verified_role_id(guild_id)
+    settings = await guild_cache.get_settings(guild_id)
+    verified_role_id = settings.verified_role_id
     if not verified_role_id:
         raise ValueError
         return
 
     verified_role = guild.get_role(int(verified_role_id))
 
-    await member.add_roles(verified_role, reason="MACS Verify")
+    await rest.scheduler.add_roles(member, verified_role, reason="MACS Verify")
 
     logger.info(f"Added verified role to {member.id} in guild: {guild.id}")
 
 
-def get_guild_from_id(guilds: List[Guild], guild_id: str):
-    for guild in guilds:
-        if str(guild.id) == guild_id:
-            return guild
+async def get_guild_from_id(bot: commands.Bot, guild_id: str) -> Guild:
+    guild = bot.get_guild(int(guild_id))
+    if guild is not None:
+        metrics.LOOKUPS.labels("guild", "cache").inc()
+        return guild
+
+    metrics.LOOKUPS.labels("guild", "rest").inc()
+    return await bot.fetch_guild(int(guild_id))
 
 
 async def get_member_from_user_id(user_id: str, guild: Guild) -> Member:
-    # for member in guild.fetch_members(limit=None):
-    #     if str(member.id) == user_id:
-    #         return member
+    member = guild.get_member(int(user_id))
+    if member is not None:
+        metrics.LOOKUPS.labels("member", "cache").inc()
+        return member
 
-    member = await guild.fetch_member(int(user_id))
-    return member
+    metrics.LOOKUPS.labels("member", "rest").inc()
+    return await guild.fetch_member(int(user_id))
 
 
-def is_verified_in_guild(member: Member, guild: Guild) -> bool:
+async def is_verified_in_guild(member: Member, guild: Guild) -> bool:
     current_role_ids = [str(role.id) for role in member.roles]
-    verified_role_id = db.get_verified_role_id(str(guild.id))
+    settings = await guild_cache.get_settings(str(guild.id))
+    verified_role_id = settings.verified_role_id
     if verified_role_id in current_role_ids:
         return True
     else:
@@ -71,21 +77,8 @@ def generate_verification_code() -> str:
     return uuid.uuid4().hex[:16]
 
 
-def email_used_in_guild(email: Email, guild_id: str) -> bool:
-    return db.email_exists_in_guild(email=email, guild_id=guild_id)
-
-
-def time_has_passed(hours: int, datetime_string: str) -> bool:
-    if not datetime_string:
-        return True
-
-    start = datetime.datetime.fromisoformat(datetime_string)
-    now = datetime.datetime.now()
-
-    if now - start > datetime.timedelta(hours=hours):
-        return True
-    else:
-        return False
+async def email_used_in_guild(email: Email, guild_id: str) -> bool:
+    return await db.email_exists_in_guild(email=email, guild_id=guild_id)
 
 
 async def send_email_debug(verification_code="", email=""):
@@ -96,8 +89,8 @@ async def send_email_debug(verification_code="", email=""):
     """)
 
 
-async def allowed_attempts(latest_attempt: Attempt, earliest_attempt: Attempt,
-                           user: User, message: Message) -> bool:
+async def allowed_attempts(latest_attempt: Attempt, user: User,
+                           message: Message) -> bool:
 
     # If the current verify guild is different to the previous one
     if latest_attempt.guild_id != str(message.guild.id):
@@ -113,31 +106,39 @@ async def allowed_attempts(latest_attempt: Attempt, earliest_attempt: Attempt,
         )
         return True
 
-    if email and not time_has_passed(
-            hours=24, datetime_string=earliest_attempt.attempt_time):
+    if email:
+        attempts_within_day = await ratelimit.limiter.count(
+            "user", f"{user.user_id}:{message.guild.id}")
+    else:
+        attempts_within_day = 0
 
-        attempts_within_day = len(user.attempts)
+    rule = ratelimit.limiter.rules["user"]
+    max_attempts = rule.limit
+    window = rule.describe_window()
+    if attempts_within_day:
 
-        dm_channel = await message.author.create_dm()
-        if attempts_within_day >= 3:
+        dm_channel = await rest.scheduler.get_dm(message.author)
+        if attempts_within_day >= max_attempts:
 
             await dm_channel.send(
-                "You have attempted 3 verifications for this server within "
-                "24 hours. Please try again in 24 hours.")
+                f"You have attempted {max_attempts} verifications for this "
+                f"server within {window}. Please try again in {window}.")
             logger.info(
-                "You have attempted 3 verifications for this server within "
-                "24 hours. Please try again in 24 hours.")
+                f"You have attempted {max_attempts} verifications for this "
+                f"server within {window}. Please try again in {window}.")
 
             return False
         else:
             await dm_channel.send(
                 f"You have attempted {attempts_within_day} verification(s) for "
-                "this server within 24 hours. "
-                f"You have {3 - attempts_within_day} attempts remaining")
+                f"this server within {window}. "
+                f"You have {max_attempts - attempts_within_day} attempts "
+                "remaining")
             logger.info(
                 f"Replied: You have attempted {attempts_within_day} verification(s) for "
-                "this server within 24 hours. "
-                f"You have {3 - attempts_within_day} attempts remaining")
+                f"this server within {window}. "
+                f"You have {max_attempts - attempts_within_day} attempts "
+                "remaining")
             return True
 
         # await dm_channel.send("A verification code has already been sent to your email.
@@ -146,12 +147,8 @@ async def allowed_attempts(latest_attempt: Attempt, earliest_attempt: Attempt,
         # enter that code or wait 24 hours to use !verify for this server again.")
         # return
     else:
-        user.attempts = []
-        db.save_user(user, str(message.guild.id))
         return True
 
-    return False
-
 
 def is_admin():
     def predicate(ctx):
@@ -4,13 +4,14 @@ from typing import Union, cast
 
 import discord  # type: ignore
 from discord import ChannelType, Game, Message, Status
-from discord.ext import commands  # type: ignore
+from discord.ext import commands, tasks  # type: ignore
 
 from ..logger import get_logger
 from .datatypes.attempt import Attempt
 from .datatypes.email_address import Email
 from .datatypes.user import User
-from .util import db, ses, util
+from .util import (db, guild_cache, metrics, ratelimit, rest, ses, sessions,
+                   util)
 from .util.config import CONFIG
 
 logger = get_logger(__name__)
@@ -22,6 +23,21 @@ class Verify(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
 
+        # Periodically reload cached guild settings so edits made directly
+        # in the db are picked up. 0 disables the refresh.
+        refresh_minutes = CONFIG["DEFAULT"].getfloat(
+            "guild_cache_refresh_minutes", fallback=0)
+        if refresh_minutes > 0:
+            self.refresh_guild_cache.change_interval(minutes=refresh_minutes)
+            self.refresh_guild_cache.start()
+
+    def cog_unload(self):
+        self.refresh_guild_cache.cancel()
+
+    @tasks.loop(minutes=10)
+    async def refresh_guild_cache(self):
+        await guild_cache.refresh_all()
+
     @commands.Cog.listener()
     async def on_message(self, message: Message):
         if message.author.bot:
@@ -29,52 +45,63 @@ class Verify(commands.Cog):
 
         # Private message
         if message.channel.type == ChannelType.private:
-            logger.info(
-                f"{message.author.name}#{message.author.discriminator}: {message.content}"
-            )
+            # DM content can include emails and codes, keep it out of INFO
+            logger.debug("%s#%s: %s", message.author.name,
+                         message.author.discriminator, message.content)
 
-            # Get the user from the db, if they haven't initiated the verification process yet,
-            # user will be None
-            user_id = str(message.author.id)
-            user = db.get_user(user_id=user_id)
+            # Get the user's session, if they haven't initiated the verification process yet,
+            # session will be None
+            await sessions.store.ready.wait()
+            session = await sessions.store.fetch(str(message.author.id))
 
             # Do nothing if this user hasn't initiated the verification process
-            if not user:
+            if not session:
                 return
 
             # If we are waiting for them to enter their email
-            if user.status == "waiting":
-                await self.handle_enter_email(message=message, user=user)
+            if session.user.status == "waiting":
+                await self.handle_enter_email(message=message, session=session)
                 return
-            elif user.status == "has code":
+            elif session.user.status == "has code":
                 await self.handle_enter_verification_code(message=message,
-                                                          user=user)
+                                                          session=session)
                 return
         else:
-            guild_id = str(message.guild.id)
-            channel_id = str(message.channel.id)
-            author_role_ids = [str(role.id) for role in message.author.roles]
-
-            prefix = CONFIG["DEFAULT"]["command_prefix"]
-
-            if all([
-                    message.clean_content.lower().split() == [
-                        prefix, 'verify'
-                    ], channel_id == db.get_verify_channel(guild_id),
-                    db.get_exec_role(guild_id) not in author_role_ids
-            ]):
-                await self.initiate_verification(message)
-            elif channel_id == db.get_verify_channel(
-                    guild_id) and db.get_exec_role(
-                        guild_id) not in author_role_ids:
-                await message.delete()
-
-            if message.clean_content.lower().replace(
-                    "\\", "") == f'{CONFIG["DEFAULT"]["command_prefix"]}banme':
-                await self.ban_user(message)
+            await self.handle_guild_message(message)
 
         # await bot.process_commands(message)
 
+    async def handle_guild_message(self, message: Message):
+        """Dispatch a guild message, cheapest checks first
+
+        Only messages in the verify channel or that look like a command get
+        past the first stage; role and mention resolution happen after that.
+        """
+        prefix = CONFIG["DEFAULT"]["command_prefix"]
+        settings = await guild_cache.get_settings(str(message.guild.id))
+
+        # Stage 1: integer channel id and raw content prefix only
+        in_verify_channel = message.channel.id == settings.verify_channel
+        content = message.content
+        looks_like_command = (content.startswith(prefix)
+                              or content.startswith("\\" + prefix))
+        if not in_verify_channel and not looks_like_command:
+            return
+
+        # Stage 2: verify channel housekeeping, needs the author's roles
+        if in_verify_channel and not any(
+                role.id == settings.exec_role
+                for role in message.author.roles):
+            if message.clean_content.lower().split() == [prefix, 'verify']:
+                await self.initiate_verification(message)
+            else:
+                await rest.scheduler.delete(message)
+
+        # Stage 3: resolves mentions, so only reached by likely commands
+        if looks_like_command and message.clean_content.lower().replace(
+                "\\", "") == f'{prefix}banme':
+            await self.ban_user(message)
+
     @commands.command(name="banme", hidden=True)
     async def ban_user(self, ctx):
         """
@@ -123,11 +150,14 @@ class Verify(commands.Cog):
         if ctx.channel.type == ChannelType.private:
             return
 
-        db.delete_user(user_id=str(ctx.author.id), guild_id=str(ctx.guild.id))
+        sessions.store.discard(str(ctx.author.id))
+        await db.delete_user(user_id=str(ctx.author.id),
+                             guild_id=str(ctx.guild.id))
 
         await ctx.message.add_reaction("✅")
 
     @commands.command(name="verify")
+    @metrics.timed_stage("initiate_verification")
     async def initiate_verification(self, ctx: Union[commands.Context,
                                                      Message]):
         """
@@ -141,12 +171,12 @@ class Verify(commands.Cog):
         if message.channel.type == ChannelType.private:
             return
 
-        if str(message.channel.id) != db.get_verify_channel(
-                str(message.guild.id)):
+        settings = await guild_cache.get_settings(str(message.guild.id))
+        if str(message.channel.id) != settings.verify_channel_id:
             return
 
         try:
-            await message.delete()
+            await rest.scheduler.delete(message)
         except discord.errors.Forbidden:
             logger.warning(f"Message deletion forbidden. {message}")
 
@@ -157,9 +187,19 @@ class Verify(commands.Cog):
             "discriminator": str(message.author.discriminator),
             "status": "verifying"
         }
-        user = db.get_user(user_id=str(message.author.id),
-                           user_details=user_details,
-                           guild_id=str(message.guild.id))
+        session = await sessions.store.fetch(str(message.author.id))
+        pending_user = sessions.store.pending_user(str(message.author.id),
+                                                   str(message.guild.id))
+        if session and session.guild_id == str(message.guild.id):
+            # The session may hold changes not yet written to the db
+            user = session.user
+        elif pending_user is not None:
+            # A finished session that hasn't been flushed yet
+            user = pending_user
+        else:
+            user = await db.get_user(user_id=str(message.author.id),
+                                     user_details=user_details,
+                                     guild_id=str(message.guild.id))
         if not user:
             user = db.create_user(user_id=str(message.author.id),
                                   user_details=user_details,
@@ -172,11 +212,11 @@ class Verify(commands.Cog):
             return
 
         # Check if the user already has the verified role in the given server
-        already_verified = util.is_verified_in_guild(member=message.author,
-                                                     guild=message.guild)
+        already_verified = await util.is_verified_in_guild(
+            member=message.author, guild=message.guild)
         if already_verified:
-            dm_channel = await message.author.create_dm()
-            await dm_channel.send("You are already verified!")
+            await rest.scheduler.send_dm(message.author,
+                                         "You are already verified!")
             logger.info("Replied: You are already verified!")
 
             return
@@ -184,14 +224,9 @@ class Verify(commands.Cog):
         # Check if the user has already been sent a verification code.
         # Don't allow another code to be sent for this user for 24 hours.
         latest_attempt = user.get_latest_attempt()
-        earliest_attempt = user.get_earliest_attempt()
-        allowed_more_attempts = True
-        if latest_attempt and earliest_attempt:
+        if latest_attempt:
             allowed_more_attempts = await util.allowed_attempts(
-                latest_attempt=latest_attempt,
-                earliest_attempt=earliest_attempt,
-                user=user,
-                message=message)
+                latest_attempt=latest_attempt, user=user, message=message)
 
             if not allowed_more_attempts:
                 return
@@ -200,18 +235,31 @@ class Verify(commands.Cog):
         # in a private message
         user.status = "waiting"
 
-        # Insert or update the user
-        db.save_user(user=user, guild_id=str(message.guild.id))
-        db.add_to_waiting(user=user, guild_id=str(message.guild.id))
+        # Insert or update the user, written to the db in the background
+        sessions.store.begin(user=user, guild_id=str(message.guild.id))
 
-        dm_channel = await message.author.create_dm()
-        await dm_channel.send(
+        await rest.scheduler.send_dm(
+            message.author,
             "Please enter your student or staff email address.")
         logger.info(
             f"Replied to {message.author.name}#{message.author.discriminator}: Please enter your student or staff email address"
         )
 
-    async def handle_enter_email(self, message, user):
+    async def reply_invalid_email(self, message):
+        await message.channel.send(
+            "Sorry, only students.mq.edu.au or mq.edu.au "
+            "email addresses are allowed. You may not use your student ID "
+            "email address.")
+        logger.info(
+            "Replied: Sorry, only students.mq.edu.au or mq.edu.au email "
+            "addresses are allowed. You may not use your student ID email address."
+        )
+
+    @metrics.timed_stage("handle_enter_email")
+    async def handle_enter_email(self, message, session: sessions.Session):
+        user = session.user
+        guild_id = session.guild_id
+
         # Grab the email from the first argument
         try:
             user_input_email = message.clean_content.split()[0]
@@ -228,31 +276,36 @@ class Verify(commands.Cog):
 
         # Perform verification
         try:
-            email = Email(user_input_email)
+            with metrics.stage("email_validation"):
+                email = Email(user_input_email)
         except Exception as e:
             logger.error(e)
+            await self.reply_invalid_email(message)
+            return
+
+        # Throttle before probing the mail server or staff directory, keyed
+        # by the validated domain
+        domain = email.address.rsplit("@", 1)[-1].lower()
+        denied_by = await ratelimit.limiter.acquire([("guild", guild_id),
+                                                     ("domain", domain),
+                                                     ("global", "global")])
+        if denied_by:
             await message.channel.send(
-                "Sorry, only students.mq.edu.au or mq.edu.au "
-                "email addresses are allowed. You may not use your student ID "
-                "email address.")
-            logger.info(
-                "Replied: Sorry, only students.mq.edu.au or mq.edu.au email "
-                "addresses are allowed. You may not use your student ID email address."
-            )
+                "Too many verification attempts right now. "
+                "Please try again later.")
+            logger.info(f"Replied: Too many verification attempts right now "
+                        f"({denied_by}).")
             return
 
-        # Reject if someone else has already used this email to verify themselves in the server
-        waiting_user = db.get_waiting_user_details(user_id=user.user_id)
-        if waiting_user:
-            try:
-                guild_id = waiting_user["guild_id"]
-            except KeyError:
-                logger.error("Waiting user does not have a guild_id")
-        else:
-            logger.info("Waiting user does not exist")
+        try:
+            await email.ensure_exists()
+        except Exception as e:
+            logger.error(e)
+            await self.reply_invalid_email(message)
             return
 
-        if util.email_used_in_guild(email=email, guild_id=str(guild_id)):
+        # Reject if someone else has already used this email to verify themselves in the server
+        if await util.email_used_in_guild(email=email, guild_id=str(guild_id)):
             await message.channel.send(
                 f"Please enter the verification code sent to {email.address}.")
             logger.info(
@@ -260,19 +313,27 @@ class Verify(commands.Cog):
             )
             return
 
+        # Counts codes sent to this user for this server
+        if not await ratelimit.limiter.hit("user",
+                                           f"{user.user_id}:{guild_id}"):
+            await message.channel.send(
+                "You have reached the verification attempt limit for this "
+                "server. Please try again later.")
+            logger.info("Replied: You have reached the verification attempt "
+                        "limit for this server.")
+            return
+
         # Random 16 char hex string
         verification_code = util.generate_verification_code()
 
         # Create a new attempt for the server with the invocation
         attempt = Attempt(verification_code, guild_id, email=email)
 
-        user.add_attempt(attempt)
-        # user.attempt_count += 1
-
         # Try to send the verification code to the given email.
         # True if there was no error
-        success = ses.send_email(verification_code=verification_code,
-                                 email=email)
+        with metrics.stage("ses_send"):
+            success = await ses.send_email(
+                verification_code=verification_code, email=email)
 
         # Report errors from Amazon SES sending email
         if not success:
@@ -283,10 +344,12 @@ class Verify(commands.Cog):
                         "")
             return
 
+        user.add_attempt(attempt)
+        # user.attempt_count += 1
+
         # Update the users status
         user.status = "has code"
-        # Update the user in the db
-        db.save_user(user=user, guild_id=guild_id)
+        sessions.store.save(session)
 
         await message.channel.send(
             f"Please enter the verification code sent to {email.address}.")
@@ -294,7 +357,11 @@ class Verify(commands.Cog):
             f"Replied: Please enter the verification code sent to {email.address}."
         )
 
-    async def handle_enter_verification_code(self, message: Message, user):
+    @metrics.timed_stage("handle_enter_verification_code")
+    async def handle_enter_verification_code(self, message: Message,
+                                             session: sessions.Session):
+        user = session.user
+
         try:
             # Grab the verification code from the first argument
             verification_code = message.clean_content.split()[0]
@@ -306,19 +373,17 @@ class Verify(commands.Cog):
             logger.info("Replied: Please send the verification code only.")
             return
 
-        # If there is an attempt associated with this user in the db that also has this verification
-        # code, then the verification code is correct
-        guild_id = user.get_latest_attempt().guild_id
-        verified_attempt = db.get_verified_attempt(
-            user_id=user.user_id,
-            guild_id=guild_id,
-            verification_code=verification_code)
+        # If there is an attempt associated with this user for the session's server that also has
+        # this verification code, then the verification code is correct
+        guild_id = session.guild_id
+        verified_attempt = user.get_attempt(verification_code=verification_code,
+                                            guild_id=guild_id)
 
         # SUCCESS
         if verified_attempt:
             try:
                 message.guild
-                await util.add_verified_role(self.bot.guilds, user.user_id,
+                await util.add_verified_role(self.bot, user.user_id,
                                              verified_attempt.guild_id)
             except discord.errors.Forbidden:
                 await message.channel.send(
@@ -345,9 +410,9 @@ class Verify(commands.Cog):
             verified_attempt.status = "verified"
             # user.verify_attempt(verification_code=verification_code)
             user.status = "verified"
-            db.add_verified_email(user_id=user.user_id,
-                                  email=verified_attempt.email,
-                                  guild_id=verified_attempt.guild_id)
+            await db.add_verified_email(user_id=user.user_id,
+                                        email=verified_attempt.email,
+                                        guild_id=verified_attempt.guild_id)
         else:
             await message.channel.send(
                 "Verification failed. Please wait and try again later.")
@@ -357,8 +422,7 @@ class Verify(commands.Cog):
             user.status = "failed"
             # TODO 10 min delay
 
-        db.save_user(user, guild_id=guild_id)
-        db.remove_from_waiting(user_id=user.user_id)
+        sessions.store.finish(user_id=user.user_id)
 
     @commands.command(name="verifiedrole")
     @util.is_admin()
@@ -373,7 +437,8 @@ class Verify(commands.Cog):
 
         role = ctx.message.role_mentions[0]
 
-        db.set_verified_role_id(ctx.guild.id, role.id)
+        await guild_cache.set_verified_role_id(str(ctx.guild.id),
+                                               str(role.id))
         await ctx.channel.send(f"{role.mention} set as the verified role.")
         logger.info(f"{role.mention} set as the verified role.")
 
@@ -385,7 +450,8 @@ class Verify(commands.Cog):
         """
         try:
             channel = ctx.message.channel_mentions[0]
-            success = db.set_verify_channel(str(ctx.guild.id), str(channel.id))
+            success = await guild_cache.set_verify_channel(
+                str(ctx.guild.id), str(channel.id))
         except IndexError:
             await ctx.send("Verify channel not specified")
 
@@ -403,7 +469,8 @@ class Verify(commands.Cog):
         """
         try:
             role = ctx.message.role_mentions[0]
-            success = db.set_exec_role(str(ctx.guild.id), str(role.id))
+            success = await guild_cache.set_exec_role(str(ctx.guild.id),
+                                                      str(role.id))
         except IndexError:
             await ctx.send("Exec role not specified")
 
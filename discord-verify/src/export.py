@@ -0,0 +1,56 @@
+"""Export a guild's verification records without going through Discord
+
+Usage:
+    python -m src.export <guild_id> [--format ndjson|csv] [--since ISO_TIME]
+                                    [--output FILE]
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+
+from .cogs.util import export
+from .logger import get_logger
+
+logger = get_logger(__name__)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Stream a guild's verified users, emails and attempts")
+    parser.add_argument("guild_id")
+    parser.add_argument("--format", choices=export.FORMATS, default="ndjson")
+    parser.add_argument(
+        "--since",
+        type=export.parse_since,
+        help="Only export users verified or attempting since this ISO 8601 "
+        "time (UTC if no offset is given)")
+    parser.add_argument("--output",
+                        help="File to write to, defaults to stdout")
+
+    return parser.parse_args(argv)
+
+
+async def run(args: argparse.Namespace) -> int:
+    if args.output is None:
+        return await export.write_export(sys.stdout,
+                                         args.guild_id,
+                                         fmt=args.format,
+                                         since=args.since)
+
+    with open(args.output, "w", encoding="utf-8", newline="") as out:
+        return await export.write_export(out,
+                                         args.guild_id,
+                                         fmt=args.format,
+                                         since=args.since)
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    count = asyncio.get_event_loop().run_until_complete(run(args))
+    logger.info(f"Exported {count} records for guild {args.guild_id}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,86 @@
+import atexit
+import json
 import logging
+import logging.handlers
+import queue
+from typing import Optional
 
+from .cogs.util.config import CONFIG
 
-def get_logger(name: str) -> logging.Logger:
-    file_handler = logging.FileHandler(filename="discord.log",
-                                       encoding="utf-8",
-                                       mode="a")
-    file_handler.setFormatter(
-        logging.Formatter("%(asctime)s:%(levelname)s:%(name)s: %(message)s"))
+PLAIN_FORMAT = "%(asctime)s:%(levelname)s:%(name)s: %(message)s"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record"""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+
+        return json.dumps(entry)
+
+
+def _file_handler() -> logging.Handler:
+    config = CONFIG["DEFAULT"]
+    filename = config.get("log_file", fallback="discord.log")
+
+    if config.get("log_rotation", fallback="size") == "time":
+        return logging.handlers.TimedRotatingFileHandler(
+            filename=filename,
+            when=config.get("log_rotate_when", fallback="midnight"),
+            backupCount=config.getint("log_backup_count", fallback=7),
+            encoding="utf-8")
+
+    return logging.handlers.RotatingFileHandler(
+        filename=filename,
+        maxBytes=config.getint("log_max_bytes", fallback=10 * 1024 * 1024),
+        backupCount=config.getint("log_backup_count", fallback=7),
+        encoding="utf-8")
 
-    stream_handler = logging.StreamHandler()
-    stream_handler.setFormatter(
-        logging.Formatter("%(asctime)s:%(levelname)s:%(name)s: %(message)s"))
+
+def setup_logging() -> None:
+    """Route all logging through a queue to a background writer thread
+
+    Handlers are attached once, to the root logger. Records are only put on
+    the queue by the logging call, the file and stream writes happen on the
+    listener's thread.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    config = CONFIG["DEFAULT"]
+    if config.get("log_format", fallback="plain") == "json":
+        formatter: logging.Formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(PLAIN_FORMAT)
+
+    handlers = [_file_handler(), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(-1)
+    logging.getLogger().addHandler(logging.handlers.QueueHandler(log_queue))
+
+    _listener = logging.handlers.QueueListener(log_queue,
+                                               *handlers,
+                                               respect_handler_level=True)
+    _listener.start()
+    # Drain anything still queued when the process exits
+    atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    setup_logging()
 
     logger = logging.getLogger(name)
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
-    logger.setLevel(logging.INFO)
+    logger.setLevel(CONFIG["DEFAULT"].get("log_level", fallback="INFO"))
 
     return logger
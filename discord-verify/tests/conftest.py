@@ -0,0 +1,9 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The bot reads config.ini relative to the working directory and is imported
+# as the src package, the same as `python -m src.bot`
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
@@ -0,0 +1,151 @@
+"""In-memory stand-ins for Motor and the discord objects the cogs touch"""
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from discord import ChannelType  # type: ignore
+
+
+def _matches(doc: Dict, query: Dict) -> bool:
+    for field, expected in query.items():
+        if isinstance(expected, dict) and "$in" in expected:
+            if doc.get(field) not in expected["$in"]:
+                return False
+        elif doc.get(field) != expected:
+            return False
+
+    return True
+
+
+class FakeCursor:
+    def __init__(self, collection: "FakeCollection", docs: List[Dict]):
+        self._collection = collection
+        self._docs = docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await self._collection.round_trip()
+        for doc in self._docs:
+            yield doc
+
+
+class FakeCollection:
+    """Answers find and find_one after a simulated server round trip
+
+    A blocking collection sleeps the way a synchronous pymongo call would,
+    holding up the event loop. Otherwise it awaits, like Motor.
+    """
+    def __init__(self, name: str, latency: float, blocking: bool):
+        self.name = name
+        self.latency = latency
+        self.blocking = blocking
+        self.docs: List[Dict] = []
+        self.round_trips = 0
+
+    async def round_trip(self) -> None:
+        self.round_trips += 1
+        if self.blocking:
+            time.sleep(self.latency)
+        else:
+            await asyncio.sleep(self.latency)
+
+    async def find_one(self, query: Dict, *args, **kwargs) -> Optional[Dict]:
+        await self.round_trip()
+        for doc in self.docs:
+            if _matches(doc, query):
+                return doc
+
+        return None
+
+    def find(self, query: Dict, *args, **kwargs) -> FakeCursor:
+        return FakeCursor(self,
+                          [doc for doc in self.docs if _matches(doc, query)])
+
+
+class FakeDatabase:
+    def __init__(self, latency: float = 0, blocking: bool = False):
+        self.latency = latency
+        self.blocking = blocking
+        self.collections: Dict[str, FakeCollection] = {}
+
+    def get_collection(self, name: str) -> FakeCollection:
+        if name not in self.collections:
+            self.collections[name] = FakeCollection(name, self.latency,
+                                                    self.blocking)
+
+        return self.collections[name]
+
+    def round_trips(self) -> int:
+        return sum(collection.round_trips
+                   for collection in self.collections.values())
+
+
+class FakeRole:
+    def __init__(self, role_id: int, name: str = "role"):
+        self.id = role_id
+        self.name = name
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, kind=ChannelType.text):
+        self.id = channel_id
+        self.type = kind
+        self.sent: List[str] = []
+
+    async def send(self, content: str):
+        self.sent.append(content)
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+
+
+class FakeAuthor:
+    bot = False
+
+    def __init__(self, user_id: int, roles: List[FakeRole]):
+        self.id = user_id
+        self.name = f"user{user_id}"
+        self.discriminator = "0001"
+        self.roles = roles
+        self.dm_channel = FakeChannel(user_id, ChannelType.private)
+
+
+class FakeMessage:
+    def __init__(self, content: str, author: FakeAuthor, channel: FakeChannel,
+                 guild: FakeGuild):
+        self.content = content
+        self.author = author
+        self.channel = channel
+        self.guild = guild
+        self.deleted = False
+
+    @property
+    def clean_content(self) -> str:
+        return self.content
+
+    async def delete(self):
+        self.deleted = True
+
+
+def install(monkeypatch, database: FakeDatabase) -> None:
+    """Point the bot's services at the fake db with no REST pacing
+
+    Call from inside the event loop the test runs on, the stores and
+    scheduler make their locks on creation.
+    """
+    from src.cogs.util import db, guild_cache, rest, sessions
+
+    monkeypatch.setattr(db, "get_db", lambda: database)
+    monkeypatch.setattr(guild_cache, "_settings", {})
+    monkeypatch.setattr(
+        rest, "scheduler",
+        rest.RestScheduler(global_rate=1e9,
+                           route_rate=1e9,
+                           role_flush_seconds=0))
+    monkeypatch.setattr(
+        sessions, "store",
+        sessions.SessionStore(flush_seconds=60, ttl_seconds=3600))
@@ -0,0 +1,88 @@
+"""Memory and throughput of the User codecs over 100k users
+
+Each user has one attempt. Memory is what tracemalloc sees newly allocated
+for the 100k live objects or dicts, including the attempts and emails they
+hold. Both codecs share the field strings with their input, so those aren't
+counted.
+"""
+import gc
+import tracemalloc
+from datetime import datetime, timezone
+
+import pytest
+
+from src.cogs.datatypes.user import User
+
+pytest.importorskip("pytest_benchmark")
+
+USERS = 100000
+
+
+def user_dicts():
+    attempt_time = datetime(2021, 2, 3, tzinfo=timezone.utc)
+    return [{
+        "user_id": str(100000000000000000 + i),
+        "name": f"user{i}",
+        "discriminator": "0001",
+        "status": "verified",
+        "attempts": [{
+            "guild_id": "700000000000000000",
+            "verification_code": f"{i:016x}",
+            "email": f"user{i}@students.mq.edu.au",
+            "attempt_time": attempt_time,
+            "status": "verified"
+        }]
+    } for i in range(USERS)]
+
+
+def allocated_by(build):
+    """Return build()'s result and the bytes still allocated for it"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return result, allocated
+
+
+@pytest.fixture(scope="module")
+def dicts():
+    return user_dicts()
+
+
+@pytest.fixture(scope="module")
+def users(dicts):
+    return [User.from_dict(user_dict) for user_dict in dicts]
+
+
+@pytest.mark.benchmark(group="codec")
+def test_from_dict_throughput(benchmark, dicts):
+    def deserialize():
+        return [User.from_dict(user_dict) for user_dict in dicts]
+
+    benchmark.pedantic(deserialize, rounds=3, iterations=1)
+
+    users, allocated = allocated_by(deserialize)
+    assert len(users) == USERS
+    benchmark.extra_info["users"] = USERS
+    benchmark.extra_info["users_per_second"] = round(
+        USERS / benchmark.stats.stats.min)
+    benchmark.extra_info["bytes_per_user"] = round(allocated / USERS)
+
+
+@pytest.mark.benchmark(group="codec")
+def test_to_dict_throughput(benchmark, users):
+    def serialize():
+        return [User.to_dict(user) for user in users]
+
+    benchmark.pedantic(serialize, rounds=3, iterations=1)
+
+    dicts, allocated = allocated_by(serialize)
+    assert dicts[0]["attempts"][0]["email"] == "user0@students.mq.edu.au"
+    benchmark.extra_info["users"] = USERS
+    benchmark.extra_info["users_per_second"] = round(
+        USERS / benchmark.stats.stats.min)
+    benchmark.extra_info["bytes_per_user"] = round(allocated / USERS)
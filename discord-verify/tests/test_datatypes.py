@@ -0,0 +1,63 @@
+from datetime import datetime, timezone
+
+from src.cogs.datatypes.attempt import Attempt
+from src.cogs.datatypes.email_address import Email
+from src.cogs.datatypes.user import User
+
+
+def make_attempt(code: str = "0123456789abcdef") -> Attempt:
+    attempt = Attempt(code,
+                      "123456789012345678",
+                      email=Email.from_trusted("jane.doe@mq.edu.au"),
+                      attempt_time=datetime(2021, 2, 3, 4, 5, 6,
+                                            tzinfo=timezone.utc))
+    attempt.status = "verified"
+
+    return attempt
+
+
+def test_attempt_round_trip():
+    attempt = make_attempt()
+
+    restored = Attempt.from_dict(Attempt.to_dict(attempt))
+
+    assert Attempt.to_dict(restored) == Attempt.to_dict(attempt)
+    assert restored.email.address == "jane.doe@mq.edu.au"
+
+
+def test_attempt_from_legacy_dict():
+    restored = Attempt.from_dict({
+        "verification_code": "0123456789abcdef",
+        "guild_id": "123456789012345678",
+        "email": "jane.doe@mq.edu.au",
+        "attempt_time": "2021-02-03 04:05:06.000001"
+    })
+
+    assert restored.status == ""
+    assert restored.attempt_time.tzinfo is not None
+
+
+def test_user_round_trip():
+    user = User("123456789012345678", "jane", "1234", "has code",
+                [make_attempt("0123456789abcdef"),
+                 make_attempt("fedcba9876543210")])
+
+    restored = User.from_dict(User.to_dict(user))
+
+    assert User.to_dict(restored) == User.to_dict(user)
+    assert restored.get_latest_attempt().verification_code == (
+        "fedcba9876543210")
+    assert restored.get_attempt("0123456789abcdef",
+                                "123456789012345678") is not None
+
+
+def test_user_from_dict_without_attempts():
+    restored = User.from_dict({
+        "user_id": "123456789012345678",
+        "name": "jane",
+        "discriminator": "1234",
+        "status": "verifying"
+    })
+
+    assert restored.attempts == []
+    assert restored.get_latest_attempt() is None
@@ -0,0 +1,74 @@
+import pytest
+from cerberus import Validator  # type: ignore
+
+from src.cogs.datatypes.email_address import Email
+from src.cogs.util.config import CONFIG
+
+# The schema Email.validate used before the regexes were precompiled
+CERBERUS_SCHEMA = {
+    "address": {
+        "type": "string",
+        "required": True,
+        "coerce": str,
+        "minlength": 11,
+        "maxlength": 100,
+        "regex": CONFIG["DEFAULT"]["valid_email_regex"],
+        "noneof": [{
+            "regex": CONFIG["DEFAULT"]["invalid_email_regex"]
+        }]
+    }
+}
+
+ADDRESSES = [
+    "jane.doe@mq.edu.au",
+    "jane.doe@students.mq.edu.au",
+    "JANE.DOE@STUDENTS.MQ.EDU.AU",
+    "jane+discord@students.mq.edu.au",
+    "a@mq.edu.au",
+    "12345678@students.mq.edu.au",
+    "MQ12345678@students.mq.edu.au",
+    "mq12345678@mq.edu.au",
+    "12345678+tag@students.mq.edu.au",
+    "12345678a@students.mq.edu.au",
+    "jane@gmail.com",
+    "jane@mq.edu.au.example.com",
+    "jane@evilmq.edu.au",
+    "jane doe@mq.edu.au",
+    "jane.doe@mq.edu.au\n",
+    "@mq.edu.au",
+    "x" * 90 + "@mq.edu.au",
+    "",
+    12345678901,
+]
+
+
+def cerberus_accepts(address) -> bool:
+    return Validator(CERBERUS_SCHEMA).validate({"address": address})
+
+
+def email_accepts(address) -> bool:
+    try:
+        Email(address)
+    except Exception:
+        return False
+
+    return True
+
+
+@pytest.mark.parametrize("address", ADDRESSES)
+def test_validator_matches_cerberus_rules(address):
+    assert email_accepts(address) == cerberus_accepts(address)
+
+
+def test_validator_accepts_staff_and_students():
+    assert Email("jane.doe@mq.edu.au").address == "jane.doe@mq.edu.au"
+    assert email_accepts("jane.doe@students.mq.edu.au")
+
+
+def test_validator_rejects_student_id_addresses():
+    assert not email_accepts("12345678@students.mq.edu.au")
+    assert not email_accepts("MQ12345678+x@students.mq.edu.au")
+
+
+def test_from_trusted_skips_validation():
+    assert Email.from_trusted("anything").address == "anything"
@@ -0,0 +1,79 @@
+"""get_user for a user with several attempts, trusted against validated
+
+"validated" rebuilds the user the way initialise_user_from_dict used to:
+validated User and Attempt construction and an Email per attempt, each
+probing the mailbox. The probe is faked with PROBE_LATENCY, a fast SMTP
+RCPT round trip; the real one was often much slower.
+"""
+import asyncio
+
+import pytest
+
+import fakes
+from src.cogs.datatypes.attempt import Attempt
+from src.cogs.datatypes.email_address import Email
+from src.cogs.datatypes.user import User
+from src.cogs.util import db, probe
+
+pytest.importorskip("pytest_benchmark")
+
+ATTEMPTS = 5
+LOOKUPS = 20
+PROBE_LATENCY = 0.005
+GUILD_ID = "700000000000000000"
+USER_ID = "100000000000000000"
+
+
+def stored_user() -> dict:
+    user = User(USER_ID, "jane", "1234", "verified")
+    for i in range(ATTEMPTS):
+        user.add_attempt(
+            Attempt(f"{i:016x}",
+                    GUILD_ID,
+                    email=Email.from_trusted(f"{i}.jane@students.mq.edu.au")))
+
+    return User.to_dict(user)
+
+
+async def get_user_validated(user_id: str, guild_id: str) -> User:
+    user_dict = await db.get_guild_collection(guild_id).find_one(
+        {"user_id": user_id})
+    user = User(user_dict["user_id"], user_dict["name"],
+                user_dict["discriminator"], user_dict["status"])
+    for attempt_dict in user_dict["attempts"]:
+        email = await Email.from_user_input(attempt_dict["email"])
+        user.add_attempt(
+            Attempt(attempt_dict["verification_code"],
+                    attempt_dict["guild_id"],
+                    email=email,
+                    attempt_time=attempt_dict["attempt_time"]))
+
+    return user
+
+
+async def fake_address_exists(address: str) -> bool:
+    await asyncio.sleep(PROBE_LATENCY)
+    return True
+
+
+GETTERS = {"trusted": db.get_user, "validated": get_user_validated}
+
+
+@pytest.mark.benchmark(group="get-user")
+@pytest.mark.parametrize("path", list(GETTERS))
+def test_get_user_latency(benchmark, monkeypatch, path):
+    database = fakes.FakeDatabase()
+    database.get_collection(GUILD_ID).docs.append(stored_user())
+    monkeypatch.setattr(db, "get_db", lambda: database)
+    monkeypatch.setattr(probe, "address_exists", fake_address_exists)
+    get_user = GETTERS[path]
+
+    async def look_up():
+        return [await get_user(USER_ID, GUILD_ID) for _ in range(LOOKUPS)]
+
+    users = benchmark.pedantic(lambda: asyncio.run(look_up()), rounds=5)
+
+    assert all(len(user.attempts) == ATTEMPTS for user in users)
+    benchmark.extra_info["attempts"] = ATTEMPTS
+    benchmark.extra_info["get_user_ms"] = round(
+        benchmark.stats.stats.min / LOOKUPS * 1000, 3)
@@ -0,0 +1,118 @@
+"""User lookup latency with and without the indexes ensure_schema makes
+
+Needs a Mongo server: set DB_HOST as for running the bot. The users are
+seeded into a separate benchmark database, which is dropped afterwards.
+"""
+import asyncio
+import random
+from datetime import datetime, timezone
+from os import environ
+
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient  # type: ignore
+from pymongo.errors import PyMongoError  # type: ignore
+
+from src.cogs.util import db
+from src.cogs.util.config import CONFIG
+
+pytest.importorskip("pytest_benchmark")
+
+USERS = 20000
+LOOKUPS = 200
+GUILD_ID = "700000000000000000"
+DB_NAME = "verify_index_benchmark"
+
+
+def user_doc(user_id: str) -> dict:
+    return {
+        "user_id": user_id,
+        "name": f"user{user_id}",
+        "discriminator": "0001",
+        "status": "verified",
+        "attempts": [{
+            "guild_id": GUILD_ID,
+            "verification_code": "0123456789abcdef",
+            "email": f"{user_id}.test@mq.edu.au",
+            "attempt_time": datetime.now(timezone.utc),
+            "status": "verified"
+        }]
+    }
+
+
+async def seed(user_ids) -> None:
+    await db.get_guild_collection(GUILD_ID).insert_many(
+        [user_doc(user_id) for user_id in user_ids])
+    # Roughly one in ten users part way through verifying
+    await db.get_waiting_collection().insert_many([{
+        "user_id": user_id,
+        "guild_id": GUILD_ID,
+        "created_at": datetime.now(timezone.utc)
+    } for user_id in user_ids[::10]])
+
+
+async def set_indexes(indexed: bool) -> None:
+    db._indexed_guilds.clear()
+    if indexed:
+        await db.ensure_schema()
+    else:
+        await db.get_guild_collection(GUILD_ID).drop_indexes()
+        await db.get_waiting_collection().drop_indexes()
+
+
+async def look_up(user_ids) -> int:
+    found = 0
+    for user_id in user_ids:
+        if await db.get_user(user_id, GUILD_ID) is not None:
+            found += 1
+        await db.get_waiting_user_details(user_id)
+
+    return found
+
+
+@pytest.fixture(scope="module")
+def seeded_db():
+    host = environ.get("DB_HOST")
+    if not host:
+        pytest.skip("Set DB_HOST to a Mongo server to run")
+
+    loop = asyncio.new_event_loop()
+    client = AsyncIOMotorClient(host=host,
+                                tz_aware=True,
+                                serverSelectionTimeoutMS=2000,
+                                io_loop=loop)
+    try:
+        loop.run_until_complete(client.admin.command("ping"))
+    except PyMongoError as e:
+        client.close()
+        loop.close()
+        pytest.skip(f"Mongo at {host} is unreachable: {e}")
+
+    user_ids = [str(100000000000000000 + i) for i in range(USERS)]
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(db, "_client", client)
+        monkeypatch.setitem(CONFIG["DEFAULT"], "db_name", DB_NAME)
+
+        loop.run_until_complete(client.drop_database(DB_NAME))
+        loop.run_until_complete(seed(user_ids))
+        try:
+            yield loop, user_ids
+        finally:
+            loop.run_until_complete(client.drop_database(DB_NAME))
+            client.close()
+            loop.close()
+
+
+@pytest.mark.benchmark(group="user-lookup")
+@pytest.mark.parametrize("indexed", [False, True],
+                         ids=["collection-scan", "indexed"])
+def test_user_lookup_latency(benchmark, seeded_db, indexed):
+    loop, user_ids = seeded_db
+    loop.run_until_complete(set_indexes(indexed))
+    sample = random.Random(0).sample(user_ids, LOOKUPS)
+
+    found = benchmark.pedantic(
+        lambda: loop.run_until_complete(look_up(sample)), rounds=5)
+
+    assert found == LOOKUPS
+    benchmark.extra_info["users"] = USERS
+    benchmark.extra_info["lookups_per_round"] = LOOKUPS
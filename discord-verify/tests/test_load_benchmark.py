@@ -0,0 +1,72 @@
+"""How many concurrent !verify flows the bot gets through per second
+
+Each flow is a "! verify" message in the verify channel, handled by
+Verify.on_message from the guild settings lookup to the DM asking for an
+email. The db answers after LATENCY seconds. "blocking" sleeps like the
+synchronous pymongo calls the cogs used to make, "motor" awaits like Motor.
+"""
+import asyncio
+import time
+
+import pytest
+from discord.ext import commands  # type: ignore
+
+import fakes
+from src.cogs import verify
+from src.cogs.util import sessions
+from src.cogs.util.config import CONFIG
+
+pytest.importorskip("pytest_benchmark")
+
+FLOWS = 200
+LATENCY = 0.002
+GUILD_ID = 700000000000000000
+VERIFY_CHANNEL_ID = 710000000000000000
+
+
+async def run_flows(monkeypatch, blocking: bool) -> int:
+    database = fakes.FakeDatabase(latency=LATENCY, blocking=blocking)
+    database.get_collection(str(GUILD_ID)).docs.append({
+        "_id": "verify_channel_id",
+        "id": str(VERIFY_CHANNEL_ID)
+    })
+    fakes.install(monkeypatch, database)
+
+    bot = commands.Bot(command_prefix="!")
+    bot.add_cog(verify.Verify(bot))
+    cog = bot.get_cog("Verify")
+
+    guild = fakes.FakeGuild(GUILD_ID)
+    channel = fakes.FakeChannel(VERIFY_CHANNEL_ID)
+    messages = [
+        fakes.FakeMessage("! verify",
+                          fakes.FakeAuthor(100000000000000000 + i, []),
+                          channel, guild) for i in range(FLOWS)
+    ]
+    await asyncio.gather(*[cog.on_message(message) for message in messages])
+
+    bot.remove_cog("Verify")
+
+    return len(sessions.store)
+
+
+@pytest.mark.benchmark(group="verify-load")
+@pytest.mark.parametrize("driver", ["blocking", "motor"])
+def test_concurrent_verify_flows(benchmark, monkeypatch, driver):
+    monkeypatch.setitem(CONFIG["DEFAULT"], "guild_cache_refresh_minutes",
+                        "0")
+    durations = []
+
+    def run():
+        start = time.perf_counter()
+        started = asyncio.run(run_flows(monkeypatch,
+                                        blocking=driver == "blocking"))
+        durations.append(time.perf_counter() - start)
+        return started
+
+    started = benchmark.pedantic(run, rounds=3, iterations=1)
+
+    assert started == FLOWS
+    benchmark.extra_info["flows"] = FLOWS
+    benchmark.extra_info["db_latency_ms"] = LATENCY * 1000
+    benchmark.extra_info["flows_per_second"] = round(FLOWS / min(durations))
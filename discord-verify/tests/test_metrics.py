@@ -0,0 +1,54 @@
+import asyncio
+from typing import Union
+
+import pytest
+from discord import Message  # type: ignore
+from discord.ext import commands  # type: ignore
+from prometheus_client import REGISTRY  # type: ignore
+
+from src.cogs import verify
+from src.cogs.util import metrics
+from src.cogs.util.config import CONFIG
+
+
+def stage_total(name: str, outcome: str) -> float:
+    return REGISTRY.get_sample_value("verify_stage_total", {
+        "stage": name,
+        "outcome": outcome
+    }) or 0
+
+
+def test_timed_commands_register_on_the_cog(monkeypatch):
+    """commands.command resolves a timed callback's string annotations when
+    verify is imported. Looked up in metrics.py, they raise NameError.
+    """
+    monkeypatch.setitem(CONFIG["DEFAULT"], "guild_cache_refresh_minutes",
+                        "0")
+
+    bot = commands.Bot(command_prefix="!")
+    bot.add_cog(verify.Verify(bot))
+    command = bot.get_command("verify")
+
+    assert command.cog is bot.get_cog("Verify")
+    assert command.params["ctx"].annotation == Union[commands.Context,
+                                                     Message]
+
+
+def test_timed_stage_counts_outcomes():
+    @metrics.timed_stage("test_stage")
+    async def succeed() -> str:
+        return "done"
+
+    @metrics.timed_stage("test_stage")
+    async def fail() -> None:
+        raise ValueError("failed")
+
+    ok = stage_total("test_stage", "ok")
+    error = stage_total("test_stage", "error")
+
+    assert asyncio.run(succeed()) == "done"
+    with pytest.raises(ValueError):
+        asyncio.run(fail())
+
+    assert stage_total("test_stage", "ok") == ok + 1
+    assert stage_total("test_stage", "error") == error + 1
@@ -0,0 +1,101 @@
+"""Guild messages per second through Verify.handle_guild_message
+
+Replays a synthetic stream shaped like a busy server: mostly chatter in
+other channels, some commands, some messages in the verify channel, which
+are deleted, and the odd "! verify".
+"""
+import asyncio
+import random
+import time
+
+import pytest
+from discord.ext import commands  # type: ignore
+
+import fakes
+from src.cogs import verify
+from src.cogs.util.config import CONFIG
+
+pytest.importorskip("pytest_benchmark")
+
+MESSAGES = 10000
+GUILD_ID = 700000000000000000
+VERIFY_CHANNEL_ID = 710000000000000000
+EXEC_ROLE_ID = 720000000000000000
+
+# (weight, channel, content)
+MIX = [
+    (90, "general", "has anyone started the COMP2310 assignment yet?"),
+    (4, "general", "!help"),
+    (1, "general", "\\!help"),
+    (4, "verify", "how do I verify?"),
+    (1, "verify", "! verify"),
+]
+
+
+def make_messages():
+    rng = random.Random(0)
+    guild = fakes.FakeGuild(GUILD_ID)
+    channels = {
+        "general": fakes.FakeChannel(730000000000000000),
+        "verify": fakes.FakeChannel(VERIFY_CHANNEL_ID)
+    }
+    exec_role = fakes.FakeRole(EXEC_ROLE_ID, "Executive")
+    member_role = fakes.FakeRole(740000000000000000, "Member")
+
+    weights = [weight for weight, _, _ in MIX]
+    messages = []
+    for i in range(MESSAGES):
+        _, channel, content = rng.choices(MIX, weights)[0]
+        roles = [member_role, exec_role] if i % 50 == 0 else [member_role]
+        author = fakes.FakeAuthor(100000000000000000 + i, roles)
+        messages.append(
+            fakes.FakeMessage(content, author, channels[channel], guild))
+
+    return messages
+
+
+async def replay(monkeypatch, messages) -> None:
+    database = fakes.FakeDatabase()
+    database.get_collection(str(GUILD_ID)).docs.extend([{
+        "_id": "verify_channel_id",
+        "id": str(VERIFY_CHANNEL_ID)
+    }, {
+        "_id": "exec_role_id",
+        "id": str(EXEC_ROLE_ID)
+    }])
+    fakes.install(monkeypatch, database)
+
+    bot = commands.Bot(command_prefix="!")
+    bot.add_cog(verify.Verify(bot))
+    cog = bot.get_cog("Verify")
+
+    for message in messages:
+        await cog.handle_guild_message(message)
+
+    bot.remove_cog("Verify")
+
+
+@pytest.mark.benchmark(group="guild-prefilter")
+def test_guild_message_throughput(benchmark, monkeypatch):
+    monkeypatch.setitem(CONFIG["DEFAULT"], "guild_cache_refresh_minutes",
+                        "0")
+    messages = make_messages()
+    durations = []
+
+    def run():
+        start = time.perf_counter()
+        asyncio.run(replay(monkeypatch, messages))
+        durations.append(time.perf_counter() - start)
+
+    benchmark.pedantic(run, rounds=5, iterations=1)
+
+    # Everything in the verify channel is cleaned up unless an exec sent it
+    assert all(message.deleted == (len(message.author.roles) == 1)
+               for message in messages
+               if message.channel.id == VERIFY_CHANNEL_ID)
+    assert not any(message.deleted for message in messages
+                   if message.channel.id != VERIFY_CHANNEL_ID)
+
+    benchmark.extra_info["messages"] = MESSAGES
+    benchmark.extra_info["messages_per_second"] = round(MESSAGES /
+                                                        min(durations))
@@ -0,0 +1,174 @@
+import asyncio
+
+from aiohttp import web  # type: ignore
+
+from src.cogs.util import probe
+from src.cogs.util.cache import TTLCache
+
+MAILBOXES = {"jane@students.mq.edu.au"}
+STAFF = [{"email_address": "jane.doe@mq.edu.au"}]
+
+
+async def start_fake_smtp(connections: list, drop_after: int = 0):
+    """An SMTP server that accepts RCPT TO for MAILBOXES only
+
+    Every connection is appended to connections. With drop_after, the server
+    hangs up after that many RCPT commands on a connection.
+    """
+    async def handle(reader, writer):
+        connections.append(writer)
+        rcpts = 0
+        writer.write(b"220 fake ESMTP\r\n")
+        while True:
+            line = (await reader.readline()).decode().strip()
+            if not line or line == "QUIT":
+                break
+            if line.startswith("EHLO"):
+                writer.write(b"250-fake\r\n250 SIZE 1000\r\n")
+            elif line.startswith("RCPT TO:"):
+                rcpts += 1
+                address = line[len("RCPT TO:<"):-1]
+                writer.write(b"250 OK\r\n" if address in
+                             MAILBOXES else b"550 No such user\r\n")
+            else:
+                writer.write(b"250 OK\r\n")
+            await writer.drain()
+            if drop_after and rcpts == drop_after and line == "RSET":
+                break
+        writer.close()
+
+    server = await asyncio.start_server(handle, "127.0.0.1", 0)
+    return server, server.sockets[0].getsockname()[1]
+
+
+async def start_fake_staff_directory():
+    async def search(request):
+        body = await request.json()
+        first, last = body["search_term"].split(" ")
+        staff = [
+            member for member in STAFF
+            if member["email_address"].startswith(f"{first}.{last}@")
+        ]
+        return web.json_response({"staff": staff})
+
+    app = web.Application()
+    app.router.add_post("/search-staff", search)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    return runner, f"http://127.0.0.1:{port}/search-staff"
+
+
+def test_smtp_probe_reuses_one_session():
+    async def run():
+        connections = []
+        server, port = await start_fake_smtp(connections)
+        prober = probe.SMTPProber("127.0.0.1", port, timeout=5)
+        try:
+            results = [
+                await prober.exists("jane@students.mq.edu.au"),
+                await prober.exists("nobody@students.mq.edu.au"),
+                await prober.exists("jane@students.mq.edu.au")
+            ]
+        finally:
+            await prober.close()
+            server.close()
+
+        return results, len(connections)
+
+    results, connections = asyncio.run(run())
+
+    assert results == [True, False, True]
+    assert connections == 1
+
+
+def test_smtp_probe_reconnects_after_server_hangs_up():
+    async def run():
+        connections = []
+        server, port = await start_fake_smtp(connections, drop_after=1)
+        prober = probe.SMTPProber("127.0.0.1", port, timeout=5)
+        try:
+            first = await prober.exists("jane@students.mq.edu.au")
+            # Let the server close the idle session
+            await asyncio.sleep(0.1)
+            second = await prober.exists("jane@students.mq.edu.au")
+        finally:
+            await prober.close()
+            server.close()
+
+        return first, second, len(connections)
+
+    assert asyncio.run(run()) == (True, True, 2)
+
+
+def test_staff_directory_probe():
+    async def run():
+        runner, url = await start_fake_staff_directory()
+        prober = probe.StaffDirectoryProber(url, timeout=5)
+        try:
+            return (await prober.exists("jane.doe@mq.edu.au"),
+                    await prober.exists("john.smith@mq.edu.au"))
+        finally:
+            await prober.close()
+            await runner.cleanup()
+
+    assert asyncio.run(run()) == (True, False)
+
+
+class CountingProber:
+    def __init__(self, exists: bool):
+        self._exists = exists
+        self.calls = 0
+
+    async def exists(self, address: str) -> bool:
+        self.calls += 1
+        return self._exists
+
+
+def test_address_exists_probes_students_and_caches(monkeypatch):
+    prober = CountingProber(exists=False)
+    monkeypatch.setattr(probe, "smtp_prober", prober)
+    monkeypatch.setattr(probe, "results", TTLCache())
+
+    address = "nobody@students.mq.edu.au"
+    assert not asyncio.run(probe.address_exists(address))
+    assert not asyncio.run(probe.address_exists(address))
+    assert prober.calls == 1
+
+
+def test_address_exists_skips_smtp_on_aws(monkeypatch):
+    prober = CountingProber(exists=False)
+    monkeypatch.setattr(probe, "smtp_prober", prober)
+    monkeypatch.setattr(probe, "results", TTLCache())
+    monkeypatch.setitem(probe.PROBE_CONFIG, "aws_instance", "True")
+
+    assert asyncio.run(probe.address_exists("nobody@students.mq.edu.au"))
+    assert prober.calls == 0
+
+
+def test_smtp_pool_probes_in_parallel():
+    async def run():
+        connections = []
+        server, port = await start_fake_smtp(connections)
+        pool = probe.SMTPProberPool(3, "127.0.0.1", port, timeout=5)
+        try:
+            # A lone probe stays on the first session
+            await pool.exists("jane@students.mq.edu.au")
+            lone = len(connections)
+            results = await asyncio.gather(*[
+                pool.exists("jane@students.mq.edu.au") for _ in range(9)
+            ])
+        finally:
+            await pool.close()
+            server.close()
+
+        return lone, results, len(connections)
+
+    lone, results, connections = asyncio.run(run())
+
+    assert lone == 1
+    assert all(results)
+    assert connections == 3
@@ -0,0 +1,129 @@
+import asyncio
+
+from src.cogs.util import ratelimit
+from src.cogs.util.ratelimit import MemoryStore, RateLimiter, Rule
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def use_clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit.time, "time", clock)
+
+    return clock
+
+
+def test_memory_store_limits_within_window(monkeypatch):
+    clock = use_clock(monkeypatch)
+    store = MemoryStore()
+    rule = Rule("user", limit=2, window=60)
+
+    async def run():
+        results = [await store.hit("user:1", rule) for _ in range(3)]
+        count = await store.count("user:1", rule)
+        clock.now += 61
+        return results, count, await store.count("user:1", rule), \
+            await store.hit("user:1", rule)
+
+    results, count, count_later, hit_later = asyncio.run(run())
+
+    assert results == [True, True, False]
+    assert count == 2
+    assert count_later == 0
+    assert hit_later
+
+
+def test_memory_store_slides_the_window(monkeypatch):
+    clock = use_clock(monkeypatch)
+    store = MemoryStore()
+    rule = Rule("user", limit=2, window=60)
+
+    async def run():
+        await store.hit("user:1", rule)
+        clock.now += 30
+        await store.hit("user:1", rule)
+        clock.now += 31
+        # Only the first hit has left the window
+        return await store.hit("user:1", rule), await store.hit(
+            "user:1", rule)
+
+    assert asyncio.run(run()) == (True, False)
+
+
+def test_memory_store_sweeps_idle_keys(monkeypatch):
+    clock = use_clock(monkeypatch)
+    store = MemoryStore()
+    short = Rule("guild", limit=5, window=10)
+    long = Rule("user", limit=5, window=3600)
+
+    async def run():
+        for key in ("guild:1", "guild:2"):
+            await store.hit(key, short)
+        await store.hit("user:1", long)
+        clock.now += MemoryStore.SWEEP_SECONDS + 1
+        await store.hit("guild:3", short)
+
+    asyncio.run(run())
+
+    # The idle guild keys are gone, the user key is still in its window
+    assert len(store) == 2
+
+
+def test_limiter_acquire_takes_all_or_nothing(monkeypatch):
+    use_clock(monkeypatch)
+    store = MemoryStore()
+    limiter = RateLimiter(
+        [Rule("guild", limit=5, window=60),
+         Rule("global", limit=1, window=60)], {
+             "guild": store,
+             "global": store
+         })
+    checks = [("guild", "1"), ("global", "global")]
+
+    async def run():
+        return (await limiter.acquire(checks), await limiter.acquire(checks),
+                await limiter.count("guild", "1"))
+
+    # The second acquire is denied by global without using up the guild rule
+    assert asyncio.run(run()) == (None, "global", 1)
+
+
+def test_limiter_acquire_undoes_hits_when_a_later_rule_denies(monkeypatch):
+    use_clock(monkeypatch)
+
+    class RacedStore(MemoryStore):
+        """Denies global hits as if another task took the last one"""
+        async def hit(self, key, rule):
+            if key.startswith("global:"):
+                return False
+            return await super().hit(key, rule)
+
+    store = RacedStore()
+    limiter = RateLimiter(
+        [Rule("guild", limit=5, window=60),
+         Rule("domain", limit=5, window=60),
+         Rule("global", limit=5, window=60)], {
+             "guild": store,
+             "domain": store,
+             "global": store
+         })
+    checks = [("guild", "1"), ("domain", "mq.edu.au"), ("global", "global")]
+
+    async def run():
+        return (await limiter.acquire(checks), await limiter.count(
+            "guild", "1"), await limiter.count("domain", "mq.edu.au"))
+
+    assert asyncio.run(run()) == ("global", 0, 0)
+
+
+def test_rule_describes_its_window():
+    assert Rule("user", 3, 86400).describe_window() == "24 hours"
+    assert Rule("user", 3, 3600).describe_window() == "1 hour"
+    assert Rule("user", 3, 1800).describe_window() == "30 minutes"
+    assert Rule("user", 3, 90).describe_window() == "90 seconds"
@@ -0,0 +1,70 @@
+import asyncio
+
+from src.cogs.util.rest import RestScheduler
+
+
+class FakeGuild:
+    id = 1
+
+
+class FakeMember:
+    guild = FakeGuild()
+
+    def __init__(self, member_id: int):
+        self.id = member_id
+        self.edits = []
+
+    async def add_roles(self, *roles, reason=None, atomic=True):
+        self.edits.append((roles, reason, atomic))
+
+
+def make_scheduler() -> RestScheduler:
+    return RestScheduler(global_rate=1000,
+                         route_rate=1000,
+                         role_flush_seconds=0.01)
+
+
+def test_roles_for_one_member_are_merged():
+    async def run():
+        scheduler = make_scheduler()
+        member = FakeMember(1)
+        await asyncio.gather(scheduler.add_roles(member, "verified"),
+                             scheduler.add_roles(member, "student"),
+                             scheduler.add_roles(member, "verified"))
+        return member.edits, scheduler.pending_role_edits()
+
+    edits, pending = asyncio.run(run())
+
+    assert edits == [(("verified", "student"), None, False)]
+    assert pending == 0
+
+
+def test_single_role_is_added_atomically():
+    async def run():
+        scheduler = make_scheduler()
+        first, second = FakeMember(1), FakeMember(2)
+        await asyncio.gather(scheduler.add_roles(first, "verified"),
+                             scheduler.add_roles(second, "verified"))
+        return first.edits, second.edits
+
+    first, second = asyncio.run(run())
+
+    assert first == [(("verified", ), None, True)]
+    assert second == [(("verified", ), None, True)]
+
+
+def test_failed_edit_fails_every_waiter():
+    class FailingMember(FakeMember):
+        async def add_roles(self, *roles, reason=None, atomic=True):
+            raise RuntimeError("Missing permissions")
+
+    async def run():
+        scheduler = make_scheduler()
+        member = FailingMember(1)
+        return await asyncio.gather(scheduler.add_roles(member, "verified"),
+                                    scheduler.add_roles(member, "student"),
+                                    return_exceptions=True)
+
+    results = asyncio.run(run())
+
+    assert [type(result) for result in results] == [RuntimeError] * 2
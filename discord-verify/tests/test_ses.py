@@ -0,0 +1,99 @@
+import asyncio
+import time
+
+from src.cogs.datatypes.email_address import Email
+from src.cogs.util import ses
+
+
+def make_dispatcher() -> ses.MailDispatcher:
+    return ses.MailDispatcher(workers=2,
+                              queue_size=100,
+                              max_send_rate=1000,
+                              max_retries=0)
+
+
+def test_stop_sends_queued_emails_first(monkeypatch):
+    sent = []
+
+    def send_one(verification_code, email):
+        time.sleep(0.01)
+        sent.append(email.address)
+        return False, None
+
+    monkeypatch.setattr(ses, "_send_one", send_one)
+
+    async def run():
+        dispatcher = make_dispatcher()
+        sends = [
+            asyncio.ensure_future(
+                dispatcher.send("0123456789abcdef",
+                                Email.from_trusted(f"{i}.a@mq.edu.au")))
+            for i in range(6)
+        ]
+        # Let the sends reach the queue
+        await asyncio.sleep(0)
+        await dispatcher.stop(timeout=5)
+
+        return await asyncio.gather(*sends)
+
+    assert asyncio.run(run()) == [True] * 6
+    assert len(sent) == 6
+
+
+def test_stop_fails_emails_left_after_the_timeout(monkeypatch):
+    def send_one(verification_code, email):
+        time.sleep(0.2)
+        return False, None
+
+    monkeypatch.setattr(ses, "_send_one", send_one)
+
+    async def run():
+        dispatcher = make_dispatcher()
+        sends = [
+            asyncio.ensure_future(
+                dispatcher.send("0123456789abcdef",
+                                Email.from_trusted(f"{i}.a@mq.edu.au")))
+            for i in range(6)
+        ]
+        await asyncio.sleep(0)
+        await dispatcher.stop(timeout=0.05)
+
+        # Nothing is left waiting on a send that will never happen
+        return await asyncio.wait_for(asyncio.gather(*sends), 1)
+
+    assert asyncio.run(run()) == [False] * 6
+
+
+def test_batches_stay_under_the_send_rate(monkeypatch):
+    batches = []
+
+    def send_bulk(batch):
+        batches.append((time.monotonic(), len(batch)))
+        return False, None, [{"Status": "Success"}] * len(batch)
+
+    monkeypatch.setattr(ses, "_send_bulk", send_bulk)
+    monkeypatch.setattr(ses, "_ensure_template", lambda: None)
+
+    async def run():
+        dispatcher = ses.MailDispatcher(workers=1,
+                                        queue_size=100,
+                                        max_send_rate=10,
+                                        max_retries=0,
+                                        batch_size=50,
+                                        flush_seconds=0.01)
+        results = await asyncio.gather(*[
+            dispatcher.send("0123456789abcdef",
+                            Email.from_trusted(f"{i}.a@mq.edu.au"))
+            for i in range(25)
+        ])
+        await dispatcher.stop()
+
+        return dispatcher.batch_size, results
+
+    batch_size, results = asyncio.run(run())
+
+    assert batch_size == 10
+    assert results == [True] * 25
+    assert [size for _, size in batches] == [10, 10, 5]
+    # A full batch uses up a second of quota before the next one goes
+    assert batches[1][0] - batches[0][0] >= 0.95
@@ -0,0 +1,187 @@
+import asyncio
+
+from pymongo import UpdateOne  # type: ignore
+
+from src.cogs.datatypes.attempt import Attempt
+from src.cogs.datatypes.email_address import Email
+from src.cogs.datatypes.user import User
+from src.cogs.util import db, sessions
+
+GUILD_ID = "123456789012345678"
+
+
+def make_user(user_id: str) -> User:
+    return User(user_id, "jane", "1234", "waiting")
+
+
+class FakeDb:
+    def __init__(self, fail: bool):
+        self.fail = fail
+        self.saved = []
+        self.waiting_added = []
+        self.waiting_removed = []
+
+    async def save_user_updates(self, requests, guild_id):
+        if self.fail:
+            raise ConnectionError("db is down")
+        self.saved.extend((request._filter["user_id"], guild_id)
+                          for request in requests)
+
+    async def update_waiting(self, add, remove):
+        if self.fail:
+            raise ConnectionError("db is down")
+        self.waiting_added.extend(user.user_id for user, _ in add)
+        self.waiting_removed.extend(remove)
+
+
+def use_db(monkeypatch, fail: bool) -> FakeDb:
+    fake = FakeDb(fail)
+    monkeypatch.setattr(db, "save_user_updates", fake.save_user_updates)
+    monkeypatch.setattr(db, "update_waiting", fake.update_waiting)
+
+    return fake
+
+
+def test_flush_requeues_on_failure(monkeypatch):
+    async def run():
+        store = sessions.SessionStore(flush_seconds=60, ttl_seconds=3600)
+        store.begin(make_user("1000000001"), GUILD_ID)
+        store.begin(make_user("1000000002"), GUILD_ID)
+        store.finish("1000000002")
+
+        down = use_db(monkeypatch, fail=True)
+        await store.flush()
+        requeued = store.pending_writes()
+        pending_user = store.pending_user("1000000002", GUILD_ID)
+
+        up = use_db(monkeypatch, fail=False)
+        await store.flush()
+
+        return down, requeued, pending_user, up, store
+
+    down, requeued, pending_user, up, store = asyncio.run(run())
+
+    assert down.saved == []
+    # Two dirty users, one waiting entry added and one removed
+    assert requeued == 4
+    assert pending_user is not None
+    assert sorted(up.saved) == [("1000000001", GUILD_ID),
+                                ("1000000002", GUILD_ID)]
+    assert up.waiting_added == ["1000000001"]
+    assert up.waiting_removed == ["1000000002"]
+    assert store.pending_writes() == 0
+    assert store.pending_user("1000000002", GUILD_ID) is None
+
+
+def test_requeue_keeps_newer_changes(monkeypatch):
+    async def run():
+        store = sessions.SessionStore(flush_seconds=60, ttl_seconds=3600)
+        store.begin(make_user("1000000001"), GUILD_ID)
+
+        fake = use_db(monkeypatch, fail=True)
+        save_user_updates = fake.save_user_updates
+
+        async def finish_during_flush(requests, guild_id):
+            # The session finishes while the failing write is in flight
+            store.finish("1000000001")
+            await save_user_updates(requests, guild_id)
+
+        monkeypatch.setattr(db, "save_user_updates", finish_during_flush)
+        await store.flush()
+
+        up = use_db(monkeypatch, fail=False)
+        await store.flush()
+
+        return up
+
+    up = asyncio.run(run())
+
+    # The finish superseded the failed waiting add
+    assert up.waiting_added == []
+    assert up.waiting_removed == ["1000000001"]
+
+
+def test_expire_drops_old_sessions():
+    async def run():
+        store = sessions.SessionStore(flush_seconds=60, ttl_seconds=3600)
+        old = store.begin(make_user("1000000001"), GUILD_ID)
+        old.started_at -= 3601
+        store.begin(make_user("1000000002"), GUILD_ID)
+
+        return store.expire(), len(store)
+
+    assert asyncio.run(run()) == (1, 1)
+
+
+def make_attempt(verification_code: str) -> Attempt:
+    return Attempt(verification_code,
+                   GUILD_ID,
+                   email=Email.from_trusted("jane@students.mq.edu.au"))
+
+
+def test_flush_writes_only_what_changed(monkeypatch):
+    async def run():
+        store = sessions.SessionStore(flush_seconds=60, ttl_seconds=3600)
+        user = make_user("1000000001")
+        user.add_attempt(make_attempt("0000000000000001"))
+        session = store.begin(user, GUILD_ID)
+
+        writes = []
+
+        async def save_user_updates(requests, guild_id):
+            writes.append(requests)
+
+        async def update_waiting(add, remove):
+            pass
+
+        monkeypatch.setattr(db, "save_user_updates", save_user_updates)
+        monkeypatch.setattr(db, "update_waiting", update_waiting)
+
+        # A new code is sent
+        user.add_attempt(make_attempt("0000000000000002"))
+        user.status = "has code"
+        store.save(session)
+        await store.flush()
+
+        # The new code verifies
+        user.attempts[1].status = "verified"
+        user.status = "verified"
+        store.finish(user.user_id)
+        await store.flush()
+
+        return user, writes
+
+    user, writes = asyncio.run(run())
+
+    # The second code was pushed before it verified
+    details = {"name": "jane", "discriminator": "1234"}
+    user_filter = {"user_id": "1000000001"}
+    assert writes == [
+        [
+            UpdateOne(user_filter, {
+                "$set": {
+                    **details, "status": "has code"
+                },
+                "$push": {
+                    "attempts": {
+                        "$each": [{
+                            **Attempt.to_dict(user.attempts[1]), "status":
+                            ""
+                        }]
+                    }
+                }
+            },
+                      upsert=True)
+        ],
+        [
+            UpdateOne(user_filter,
+                      {"$set": {
+                          "attempts.1.status": "verified"
+                      }}),
+            UpdateOne(user_filter,
+                      {"$set": {
+                          **details, "status": "verified"
+                      }},
+                      upsert=True)
+        ]
+    ]
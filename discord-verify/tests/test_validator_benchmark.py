@@ -0,0 +1,60 @@
+"""Objects per second for validated User, Attempt and Email construction
+
+"rebuilt-validator" times the email rules with a cerberus Validator built per
+object, as Email.validate did before the validators were made once per
+module.
+"""
+import pytest
+from cerberus import Validator  # type: ignore
+
+from src.cogs.datatypes.attempt import Attempt
+from src.cogs.datatypes.email_address import Email
+from src.cogs.datatypes.user import User
+from test_email_address import CERBERUS_SCHEMA
+
+pytest.importorskip("pytest_benchmark")
+
+OBJECTS = 1000
+EMAIL = Email.from_trusted("jane.doe@students.mq.edu.au")
+
+
+def build_emails():
+    return [Email(f"jane.doe{i}@students.mq.edu.au") for i in range(OBJECTS)]
+
+
+def build_emails_with_rebuilt_validator():
+    for i in range(OBJECTS):
+        Validator(CERBERUS_SCHEMA).validate(
+            {"address": f"jane.doe{i}@students.mq.edu.au"})
+
+
+def build_attempts():
+    return [
+        Attempt(f"{i:016x}", "123456789012345678", email=EMAIL)
+        for i in range(OBJECTS)
+    ]
+
+
+def build_users():
+    return [
+        User(str(100000000000000000 + i), "jane", "1234", "waiting")
+        for i in range(OBJECTS)
+    ]
+
+
+BUILDERS = {
+    "email": build_emails,
+    "email-rebuilt-validator": build_emails_with_rebuilt_validator,
+    "attempt": build_attempts,
+    "user": build_users,
+}
+
+
+@pytest.mark.benchmark(group="construction")
+@pytest.mark.parametrize("kind", list(BUILDERS))
+def test_construction_throughput(benchmark, kind):
+    benchmark.pedantic(BUILDERS[kind], rounds=5, iterations=1)
+
+    benchmark.extra_info["objects"] = OBJECTS
+    benchmark.extra_info["objects_per_second"] = round(
+        OBJECTS / benchmark.stats.stats.min)